@@ -4,9 +4,14 @@ Handles UI, image generation, gallery viewing, and state management.
 """
 import sys
 import os
-from datetime import datetime
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
+from diskcache import Cache
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from dotenv import load_dotenv
+from botocore.exceptions import ClientError
 
 # パス設定
 sys.path.append(os.getcwd())
@@ -16,29 +21,31 @@ from src.generator import ImageGenerator
 from src.state_manager import (
     StateManager, STATUS_EXCLUDED, STATUS_UNPROCESSED, STATUS_REGISTERED
 )
-from src.submission_manager import SubmissionManager
-from src.storage import S3Manager
-from src.job_manager import GenerationJob
+from src.storage import S3Manager, get_s3_manager
+from src.thumbnails import make_thumbnail, thumbnail_key
+from src.job_manager import GenerationJob, JobRegistry, SubmissionJob
 
 # セットアップ
+@st.cache_resource
 def configure_environment():
     """
     Configure environment variables for Local (.env) and Remote (Streamlit Cloud).
     Prioritizes Streamlit Secrets if available, ensuring os.environ is consistent.
+    Streamlit re-executes this script on every rerun, so the work is cached
+    to run once per process.
     """
     # 1. Load local .env file (if exists)
     load_dotenv()
 
     # 2. Overlay Streamlit Secrets (for Cloud Deployment)
     try:
-        if hasattr(st, "secrets"):
-            # Generic copy for strings
-            for key, value in st.secrets.items():
-                if isinstance(value, str):
-                    os.environ[key] = value
-                
-    except Exception: # pylint: disable=broad-exception-caught
-        pass
+        secrets = st.secrets.to_dict()
+    except FileNotFoundError:
+        # No secrets.toml (local run with .env only)
+        secrets = {}
+
+    # Generic copy for strings
+    os.environ.update({k: v for k, v in secrets.items() if isinstance(v, str)})
 
 configure_environment()
 
@@ -49,6 +56,76 @@ if "keyword_input" not in st.session_state:
 if "tags_input" not in st.session_state:
     st.session_state.tags_input = ""
 
+@st.cache_resource
+def get_generator(api_key: str, model_name: str = "gpt-image-1.5") -> ImageGenerator:
+    """
+    ImageGeneratorをプロセス単位でキャッシュする。
+    OpenAIクライアントの初期化をリラン毎に行わないため。
+    返されたインスタンスは全セッションで共有されるので変更しないこと。
+    """
+    return ImageGenerator(api_key, model_name=model_name)
+
+@st.cache_resource
+def get_s3() -> S3Manager:
+    """S3Managerをプロセス単位でキャッシュし、boto3クライアントと接続プールを再利用する"""
+    return get_s3_manager()
+
+@st.cache_data(ttl=3600)
+def _styles_dict() -> dict:
+    """スタイル定義をキャッシュする (デプロイ中は静的なのでttlは保険)"""
+    return get_generator(API_KEY).get_styles()
+
+@st.cache_data(ttl=3600)
+def _style_options() -> tuple:
+    """
+    スタイル選択用のラベル一覧と、ラベル -> キーの逆引きマップ。
+    Returns: (style_labels, label_to_key)
+    """
+    styles = _styles_dict()
+    style_labels = [v["label"] for v in styles.values()]
+    label_to_key = {v["label"]: k for k, v in styles.items()}
+    return style_labels, label_to_key
+
+@st.cache_resource
+def get_state_mgr() -> StateManager:
+    """
+    StateManagerをプロセス単位でキャッシュする。
+    リラン毎にS3からDBを読み直さないため。dbの更新はStateManager側のロックで保護される。
+    """
+    return StateManager()
+
+def _db_revision() -> int:
+    """
+    StateManagerのDBリビジョン。ステータス別キャッシュの引数に含めることで、
+    バックグラウンドジョブや他セッションによる更新でも自動的に無効化される。
+    """
+    return get_state_mgr().revision
+
+@st.cache_data(ttl=60, max_entries=8, show_spinner=False)
+def _images_by_status(status: str, revision: int) -> list: # pylint: disable=unused-argument
+    """
+    ステータス別の画像リストをキャッシュする。
+    revisionはキャッシュキーとしてのみ使う (_db_revision()を渡す)。
+    """
+    return get_state_mgr().get_images_by_status(status)
+
+@st.cache_data(ttl=60, max_entries=64, show_spinner=False)
+def _images_page(status: str, offset: int, limit: int, revision: int) -> list: # pylint: disable=unused-argument
+    """ステータス別の画像リストの1ページ分をキャッシュする"""
+    return get_state_mgr().get_images_by_status(status, offset=offset, limit=limit)
+
+@st.cache_data(ttl=60, max_entries=8, show_spinner=False)
+def _count_by_status(status: str, revision: int) -> int: # pylint: disable=unused-argument
+    """ステータス別の画像数をキャッシュする"""
+    return get_state_mgr().count_by_status(status)
+
+def _clear_status_caches():
+    """DB更新後にステータス別のキャッシュを無効化する"""
+    _images_by_status.clear()
+    _images_page.clear()
+    _count_by_status.clear()
+    _registered_batches.clear()
+
 def check_password():
     """Returns `True` if the user had the correct password."""
     
@@ -103,11 +180,12 @@ def get_remote_ip():
     return "127.0.0.1"
 
 @st.dialog("Image Details")
-def view_image_details(image_path, prompt, tags, keyword):
+def view_image_details(image_key, prompt, tags, keyword):
     """
     Show image details in a modal dialog.
+    image_key: S3 Key. フルサイズ画像はダイアログ表示時にのみ取得する。
     """
-    st.image(image_path, width="stretch")
+    st.image(load_s3_image(image_key), width="stretch")
     st.caption(f"Prompt: {prompt}")
     st.caption(f"Tags: {tags}")
     if keyword:
@@ -174,44 +252,129 @@ def main():
         render_gallery_tab()
 
 
+@st.cache_resource
+def get_job_registry() -> JobRegistry:
+    """バックグラウンドジョブのレジストリ (プロセス内で共有)"""
+    return JobRegistry()
+
+
+def get_active_job():
+    """
+    このセッションの生成ジョブを返す。
+    セッションが失われてもURLのjobパラメータから復元できるようにする。
+    """
+    job_id = st.session_state.get('active_job_id') or st.query_params.get("job")
+    job = get_job_registry().get(job_id)
+    if job is not None:
+        st.session_state['active_job_id'] = job_id
+    return job
+
+
+def set_active_job(job_id):
+    """生成ジョブのIDをセッションとURLに記録する"""
+    st.session_state['active_job_id'] = job_id
+    st.query_params["job"] = job_id
+
+
+def clear_active_job():
+    """終了した生成ジョブをレジストリとセッションから取り除く"""
+    job_id = st.session_state.pop('active_job_id', None)
+    get_job_registry().remove(job_id)
+    if "job" in st.query_params:
+        del st.query_params["job"]
+
+
+def get_active_submission():
+    """
+    このセッションの登録ジョブを返す。
+    生成ジョブと同様に、セッションが失われてもURLのsubmissionパラメータから復元する。
+    """
+    job_id = st.session_state.get('active_submission_id') or st.query_params.get("submission")
+    job = get_job_registry().get(job_id)
+    if job is not None:
+        st.session_state['active_submission_id'] = job_id
+    return job
+
+
+def set_active_submission(job_id):
+    """登録ジョブのIDをセッションとURLに記録する"""
+    st.session_state['active_submission_id'] = job_id
+    st.query_params["submission"] = job_id
+
+
+def clear_active_submission():
+    """終了した登録ジョブをレジストリとセッションから取り除く"""
+    job_id = st.session_state.pop('active_submission_id', None)
+    get_job_registry().remove(job_id)
+    if "submission" in st.query_params:
+        del st.query_params["submission"]
+
+
 def _render_sidebar_status():
     """
     Render background job status in the sidebar.
     """
-    if 'active_job' in st.session_state:
-        job = st.session_state['active_job']
-        status = job.status
+    job = get_active_job()
+    if job is None:
+        return
+
+    with st.sidebar:
+        if job.status['is_running']:
+            # 実行中はフラグメントで定期的に再描画し、進捗をリラン無しで更新する
+            _render_running_job_status()
+        else:
+            _render_job_status_panel(job)
+
+
+@st.fragment(run_every="2s")
+def _render_running_job_status():
+    """
+    Poll the running job. Triggers a full rerun once it finishes so the
+    final state is shown and the Generate button is re-enabled.
+    """
+    job = get_active_job()
+    if job is None or not job.status['is_running']:
+        st.rerun()
+    _render_job_status_panel(job)
+
+
+def _render_job_status_panel(job):
+    """
+    Render the status panel (message, action button, progress) for a job.
+    """
+    status = job.status
+
+    # Compact container
+    with st.container():
+        st.markdown("---")
         
-        # Compact container
-        with st.sidebar.container():
-            st.markdown("---")
+        # Row 1: Status Message & Action
+        c1, c2 = st.columns([4, 1])
+        with c1:
+            # Use bold text for visibility without box
+            msg = status.get('message', 'Processing...')
+            # Truncate if too long
+            if len(msg) > 25:
+                msg = msg[:24] + "..."
+            st.markdown(f"**⚙️ {msg}**")
+        with c2:
+            if status['is_running']:
+                if st.button("⏹", key="stop_job", help="Stop"):
+                    job.cancel()
+                    st.rerun()
+            elif status['is_complete'] or status.get('error'):
+                if st.button("x", key="clear_job", help="Clear"):
+                    clear_active_job()
+                    _clear_status_caches()
+                    st.rerun()
+
+        # Row 2: Progress (Thin)
+        st.progress(status['progress'])
+
+        if status.get('error'):
+            st.caption(f"Error: {status['error']}")
             
-            # Row 1: Status Message & Action
-            c1, c2 = st.columns([4, 1])
-            with c1:
-                # Use bold text for visibility without box
-                msg = status.get('message', 'Processing...')
-                # Truncate if too long
-                if len(msg) > 25:
-                    msg = msg[:24] + "..."
-                st.markdown(f"**⚙️ {msg}**")
-            with c2:
-                if status['is_running']:
-                    if st.button("⏹", key="stop_job", help="Stop"):
-                        job.cancel()
-                        st.rerun()
-                elif status['is_complete'] or status.get('error'):
-                    if st.button("x", key="clear_job", help="Clear"):
-                        del st.session_state['active_job']
-                        st.rerun()
-
-            # Row 2: Progress (Thin)
-            st.progress(status['progress'])
-
-            if status.get('error'):
-                st.caption(f"Error: {status['error']}")
-                
-            st.markdown("---")
+        st.markdown("---")
 
 
 def render_generate_tab():
@@ -252,23 +415,19 @@ def render_generate_tab():
         )
 
         # スタイル定義を取得して動的に設定
-        gen_instance = ImageGenerator(API_KEY)
-        styles = gen_instance.get_styles()
-        style_keys = list(styles.keys())
-        style_labels = [styles[k]["label"] for k in style_keys]
+        styles = _styles_dict()
+        style_labels, label_to_key = _style_options()
 
         selected_label = st.selectbox("Style", style_labels, index=0)
-        style = next(k for k, v in styles.items() if v["label"] == selected_label)
+        style = label_to_key[selected_label]
 
         # スタイルの説明を表示
         with st.expander("Style Details"):
             st.info(f"Style Prompt: {styles[style]['idea_prompt']}")
 
     # 実行ボタン (すでにジョブが走っている場合は無効化)
-    is_running = False
-    if 'active_job' in st.session_state:
-        if st.session_state['active_job'].status['is_running']:
-            is_running = True
+    active_job = get_active_job()
+    is_running = active_job is not None and active_job.status['is_running']
 
     if st.button("Generate Images", type="primary", disabled=is_running):
         if not keyword:
@@ -277,10 +436,11 @@ def render_generate_tab():
             # Start background job
             job = GenerationJob(
                 API_KEY, keyword, tags, n_images, model, style, size,
-                creator_ip=st.session_state.get('user_ip', '127.0.0.1')
+                creator_ip=st.session_state.get('user_ip', '127.0.0.1'),
+                generator=get_generator(API_KEY, model_name=model),
+                state_mgr=get_state_mgr()
             )
-            job.start()
-            st.session_state['active_job'] = job
+            set_active_job(get_job_registry().submit(job))
             st.toast("Generation started in background!", icon="🚀")
             st.rerun()
 
@@ -311,62 +471,190 @@ def render_gallery_tab():
     }
     status_filter = status_map[status_filter_label]
 
+    if st.sidebar.button("🧹 Clear image cache", key="btn_clear_img_cache"):
+        clear_image_caches()
+        st.toast("Image cache cleared.", icon="🧹")
+
     render_gallery_content(status_filter)
 
 
-@st.cache_data(ttl=86400)
+IMAGE_DISK_CACHE_DIR = os.path.join(tempfile.gettempdir(), "as_img_cache")
+
+@st.cache_resource
+def get_image_disk_cache() -> Cache:
+    """
+    フルサイズ画像のディスクキャッシュ (L2)。
+    プロセス再起動後もS3へ取りに行かず、かつメモリ使用量を抑えるため。
+    """
+    return Cache(IMAGE_DISK_CACHE_DIR, size_limit=2 * 1024 ** 3)
+
+def _read_image_through_disk_cache(key: str) -> bytes:
+    """ディスクキャッシュ (L2) を経由してS3から画像を読む (メモリにはキャッシュしない)"""
+    disk_cache = get_image_disk_cache()
+    img_bytes = disk_cache.get(key)
+    if img_bytes is None:
+        img_bytes = get_s3().download_file(key)
+        disk_cache.set(key, img_bytes, expire=86400)
+    return img_bytes
+
+@st.cache_data(ttl=3600, max_entries=8, show_spinner=False)
 def load_s3_image(key: str) -> bytes:
-    """S3から画像をロードしてキャッシュする"""
-    s3 = S3Manager()
-    return s3.download_file(key)
+    """
+    S3から画像をロードしてキャッシュする。
+    フルサイズPNGは大きいので、メモリ上 (L1) は詳細表示で開いた直近の数枚のみ保持し、
+    それ以外はディスクキャッシュ (L2) を経由してS3を参照する。
+    """
+    return _read_image_through_disk_cache(key)
+
+@st.cache_data(ttl=3000, show_spinner=False)
+def _presigned_zip_url(zip_key: str) -> str:
+    """
+    ZIPのPresigned URL (有効期限1時間) をキャッシュする。
+    期限切れのURLを返さないよう、ttlは有効期限より短くする。
+    """
+    return get_s3().get_presigned_url(zip_key, expiration=3600)
+
+def clear_image_caches():
+    """画像のメモリ・ディスクキャッシュをすべて破棄する"""
+    get_image_disk_cache().clear()
+    load_s3_image.clear()
+    load_thumbnail.clear()
+
+@st.cache_data(max_entries=2000, persist="disk", show_spinner=False)
+def load_thumbnail(key: str) -> bytes:
+    """
+    グリッド表示用のサムネイル(WEBP)をロードしてキャッシュする。
+    フルサイズのPNGをブラウザへ送らないため。詳細表示ではload_s3_imageを使う。
+    生成時に作成済みのthumbs/を優先し、無い画像(過去分)はフルサイズから作成して保存する。
+    """
+    s3 = get_s3()
+    thumb_key = thumbnail_key(key)
+    try:
+        return s3.download_file(thumb_key)
+    except ClientError:
+        pass
+    # 過去分のフルサイズ画像でL1を埋めないよう、ディスクキャッシュから直接読む
+    thumb = make_thumbnail(_read_image_through_disk_cache(key))
+    s3.upload_file_async(thumb, thumb_key, content_type="image/webp")
+    return thumb
+
+def prefetch_s3_images(keys: list, max_workers: int = 16, loader=None) -> dict:
+    """
+    表示予定の画像を並列にロードする (S3 GETのレイテンシを重ねる)。
+    loader: キーからbytesを返す関数 (デフォルトはload_s3_image)
+    Returns: {key: bytes or None} 取得に失敗したキーはNone
+    """
+    loader = loader or load_s3_image
+    if not keys:
+        return {}
+
+    ctx = get_script_run_ctx()
+
+    def _load(key):
+        # ワーカースレッドからもst.cache_dataを使えるようにコンテキストを付与
+        add_script_run_ctx(threading.current_thread(), ctx)
+        try:
+            return loader(key)
+        except Exception: # pylint: disable=broad-exception-caught
+            return None
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(keys))) as executor:
+        return dict(zip(keys, executor.map(_load, keys)))
 
 def render_gallery_content(status_filter): # pylint: disable=too-many-locals, too-many-branches, too-many-statements
     """
     Render gallery content based on the selected status filter.
     Includes Pagination and Cache.
     """
-    state_mgr = StateManager()
-    all_images = state_mgr.get_images_by_status(status_filter)
+    # StateManagerはキャッシュされているため、外部(CLI等)で追加された画像は
+    # 再スキャンするまで表示されない。画像の有無にかかわらずボタンを出しておく
+    # スキャンはS3の全オブジェクトを走査するため、バックグラウンドで実行する
+    is_scanning = _rescan_thread_alive()
+    if st.sidebar.button("Forced Rescan", disabled=is_scanning):
+        start_rescan()
+        st.rerun()
+    if is_scanning or st.session_state.get('rescan_pending'):
+        with st.sidebar:
+            _render_rescan_status()
+
+    total_images = _count_by_status(status_filter, _db_revision())
 
-    if not all_images:
+    if not total_images:
         st.info(f"No images found in {status_filter}.")
-        # 画像がない場合でも再度スキャンできるボタンがあると便利
-        if st.sidebar.button("Forced Rescan"):
-            state_mgr.scan_and_sync()
-            st.rerun()
         return
 
-    st.write(f"Found {len(all_images)} images.")
+    st.write(f"Found {total_images} images.")
 
     if status_filter == STATUS_REGISTERED:
-        _render_registered_gallery(all_images)
+        _render_registered_gallery()
     else:
-        _render_unprocessed_or_excluded_gallery(all_images, status_filter)
+        _render_unprocessed_or_excluded_gallery(total_images, status_filter)
+
+
+@st.cache_resource
+def _rescan_holder() -> dict:
+    """プロセス内で実行中の再スキャンスレッドを保持する (同時に1つだけ走らせる)"""
+    return {"thread": None}
+
+
+def _rescan_thread_alive() -> bool:
+    """再スキャンが実行中かどうか"""
+    thread = _rescan_holder()["thread"]
+    return thread is not None and thread.is_alive()
+
+
+def start_rescan():
+    """Run StateManager.scan_and_sync in a background thread."""
+    holder = _rescan_holder()
+    if not _rescan_thread_alive():
+        holder["thread"] = threading.Thread(
+            target=get_state_mgr().scan_and_sync, name="state-rescan", daemon=True
+        )
+        holder["thread"].start()
+    st.session_state['rescan_pending'] = True
 
 
-def _render_registered_gallery(all_images):
+@st.fragment(run_every="2s")
+def _render_rescan_status():
     """
-    Render gallery for Registered images with grouping by submission.
+    Poll the rescan thread. Triggers a full rerun once it finishes so the
+    gallery picks up the new DB revision.
+    """
+    if _rescan_thread_alive():
+        st.caption("🔄 Scanning S3...")
+        return
+    st.session_state.pop('rescan_pending', None)
+    _clear_status_caches()
+    st.rerun()
+
+
+LEGACY_BATCH_KEY = "Legacy (No Batch Info)"
+
+@st.cache_data(ttl=60, show_spinner=False)
+def _registered_batches(revision: int) -> tuple:
+    """
+    登録済み画像をsubmission_idごとにグループ化してキャッシュする。
+    Returns: (sorted_keys, grouped) 新しいバッチ順、Legacyは末尾
     """
     # Group by submission_id
     grouped = {}
-    legacy_key = "Legacy (No Batch Info)"
-    
-    for img in all_images:
-        sub_id = img.get("submission_id")
-        if not sub_id:
-            sub_id = legacy_key
-        
-        if sub_id not in grouped:
-            grouped[sub_id] = []
-        grouped[sub_id].append(img)
-    
+    for img in _images_by_status(STATUS_REGISTERED, revision):
+        sub_id = img.get("submission_id") or LEGACY_BATCH_KEY
+        grouped.setdefault(sub_id, []).append(img)
+
     # Sort groups: Newest submission first
-    sorted_keys = sorted([k for k in grouped.keys() if k != legacy_key], reverse=True)
-    if legacy_key in grouped:
-        sorted_keys.append(legacy_key)
-        
-    s3 = S3Manager()
+    sorted_keys = sorted([k for k in grouped if k != LEGACY_BATCH_KEY], reverse=True)
+    if LEGACY_BATCH_KEY in grouped:
+        sorted_keys.append(LEGACY_BATCH_KEY)
+    return sorted_keys, grouped
+
+
+def _render_registered_gallery():
+    """
+    Render gallery for Registered images with grouping by submission.
+    """
+    sorted_keys, grouped = _registered_batches(_db_revision())
+    legacy_key = LEGACY_BATCH_KEY
 
     for sub_id in sorted_keys:
         images = grouped[sub_id]
@@ -386,128 +674,78 @@ def _render_registered_gallery(all_images):
             if sub_id != legacy_key:
                 zip_key = f"{sub_id}/submission.zip"
                 
-                # Presigned URLの発行 (有効期限 1時間)
-                url = s3.get_presigned_url(zip_key, expiration=3600)
+                # Presigned URLの発行 (有効期限 1時間, キャッシュ済みのものを再利用)
+                url = _presigned_zip_url(zip_key)
                 
                 if url:
-                    # HTMLリンクとして表示 (ボタン風のスタイル)
-                    st.markdown(
-                        f"""
-                        <a href="{url}" download style="text-decoration:none;">
-                            <button style="
-                                display: inline-flex;
-                                -webkit-box-align: center;
-                                align-items: center;
-                                -webkit-box-pack: center;
-                                justify-content: center;
-                                font-weight: 400;
-                                padding: 0.25rem 0.75rem;
-                                border-radius: 0.5rem;
-                                min-height: 38.4px;
-                                margin: 0px;
-                                line-height: 1.6;
-                                color: inherit;
-                                width: auto;
-                                user-select: none;
-                                background-color: rgb(255, 255, 255);
-                                border: 1px solid rgba(49, 51, 63, 0.2);
-                            ">
-                                📥 Download ZIP (Direct)
-                            </button>
-                        </a>
-                        """,
-                        unsafe_allow_html=True
-                    )
+                    st.link_button("📥 Download ZIP (Direct)", url, type="secondary")
                 else:
                     st.caption("ZIP link unavailable.")
 
             # Grid Display
+            # バッチ内のサムネイルをまとめて並列取得しておく
+            thumb_map = prefetch_s3_images(
+                [img['path'] for img in images], loader=load_thumbnail
+            )
             cols = st.columns(4)
             for idx, img in enumerate(images):
                 file_path = img['path']
                 with cols[idx % 4]:
-                    try:
-                        img_bytes = load_s3_image(file_path)
-                        st.image(img_bytes, width="stretch")
-
-                        # 詳細ボタン
-                        if st.button("🔍 Details", key=f"btn_det_reg_{file_path}"):
-                            view_image_details(
-                                img_bytes,
-                                img.get('prompt', ''),
-                                img.get('tags', ''),
-                                img.get('keyword', '')
-                            )
-
-                        unique_key = f"chk_reg_{file_path}"
-                        if st.checkbox("Select", key=unique_key):
-                            if 'selection_REGISTERED' not in st.session_state:
-                                st.session_state['selection_REGISTERED'] = []
-                            if file_path not in st.session_state['selection_REGISTERED']:
-                                st.session_state['selection_REGISTERED'].append(file_path)
-
-                    except Exception as e: # pylint: disable=broad-exception-caught
+                    thumb_bytes = thumb_map.get(file_path)
+                    if thumb_bytes is None:
                         st.error("Error")
+                        continue
+                    st.image(thumb_bytes, width="stretch")
+
+                    # 詳細ボタン
+                    if st.button("🔍 Details", key=f"btn_det_reg_{file_path}"):
+                        view_image_details(
+                            file_path,
+                            img.get('prompt', ''),
+                            img.get('tags', ''),
+                            img.get('keyword', '')
+                        )
+
+                    _render_select_checkbox(
+                        STATUS_REGISTERED, file_path, _selection_set(STATUS_REGISTERED)
+                    )
 
 
-def _render_unprocessed_or_excluded_gallery(all_images, status_filter):
+def _render_unprocessed_or_excluded_gallery(total_images, status_filter):
     """
     Render gallery for Unprocessed or Excluded images (Standard Grid).
     """
-    # Pagination Setup
-    items_per_page = 30
-    if f'page_{status_filter}' not in st.session_state:
-        st.session_state[f'page_{status_filter}'] = 0
-    
-    current_page = st.session_state[f'page_{status_filter}']
-    total_pages = (len(all_images) + items_per_page - 1) // items_per_page
-    
-    start_idx = current_page * items_per_page
-    end_idx = min(start_idx + items_per_page, len(all_images))
-    display_images = all_images[start_idx:end_idx]
-
-    # Pagination UI
-    col_p1, col_p2, col_p3 = st.columns([1, 2, 1])
-    with col_p1:
-        if st.button("Previous", key=f"prev_{status_filter}", disabled=current_page == 0):
-            st.session_state[f'page_{status_filter}'] -= 1
-            st.rerun()
-    with col_p2:
-        st.write(f"Page {current_page + 1} / {total_pages}")
-    with col_p3:
-        if st.button("Next", key=f"next_{status_filter}", disabled=current_page >= total_pages - 1):
-            st.session_state[f'page_{status_filter}'] += 1
-            st.rerun()
-
-    if 'selected_images' not in st.session_state:
-        st.session_state.selected_images = []
-
     # サイドバーにアクションボタンを配置
+    # (フラグメント内からはサイドバーに書き込めないため、グリッドの外で描画する)
     st.sidebar.divider()
     st.sidebar.subheader("Actions")
 
     # アクションボタン
     key_suffix = f"_{status_filter}"
     if status_filter == STATUS_UNPROCESSED:
+        is_submitting = get_active_submission() is not None
         if st.sidebar.button(
             "📤 Register Selected",
             key=f"btn_reg{key_suffix}",
-            type="primary"
+            type="primary",
+            disabled=is_submitting
         ):
             process_registration(keyword="batch_submit", status_filter=status_filter)
 
+        # 登録ジョブの進捗 (完了時にダウンロードボタンを表示する)
+        with st.sidebar:
+            _render_submission_status()
+
         if st.sidebar.button("🗑️ Exclude Selected", key=f"btn_exc{key_suffix}"):
             process_exclusion(status_filter)
             st.rerun()
 
         # Download Button (Persistent)
-        if 'latest_zip_data' in st.session_state:
-            st.sidebar.download_button(
-                label="📦 Download Last Submission",
-                data=st.session_state['latest_zip_data'],
-                file_name=st.session_state['latest_zip_name'],
-                mime="application/zip",
-                key="btn_download_zip"
+        # ZIPはS3に保存済みなので、バイト列は保持せずPresigned URLで直接ダウンロードさせる
+        if 'latest_zip_key' in st.session_state:
+            st.sidebar.link_button(
+                "📦 Download Last Submission",
+                _presigned_zip_url(st.session_state['latest_zip_key'])
             )
 
     else:
@@ -516,99 +754,227 @@ def _render_unprocessed_or_excluded_gallery(all_images, status_filter):
             process_revert(status_filter)
             st.rerun()
 
+    _render_gallery_grid(total_images, status_filter)
+
+
+@st.fragment
+def _render_gallery_grid(total_images, status_filter):
+    """
+    Render the paginated image grid.
+    Runs as a fragment so checkbox toggles and paging only rerun the grid.
+    """
+    # Pagination Setup
+    items_per_page = 30
+    if f'page_{status_filter}' not in st.session_state:
+        st.session_state[f'page_{status_filter}'] = 0
+    
+    current_page = st.session_state[f'page_{status_filter}']
+    total_pages = (total_images + items_per_page - 1) // items_per_page
+    
+    start_idx = current_page * items_per_page
+    # 表示するページ分だけStateManagerから取得する
+    display_images = _images_page(status_filter, start_idx, items_per_page, _db_revision())
+
+    # Pagination UI
+    col_p1, col_p2, col_p3 = st.columns([1, 2, 1])
+    with col_p1:
+        # ページ移動はコールバックで行う (フラグメント内のウィジェットなのでフラグメントのみ再実行される)
+        st.button(
+            "Previous", key=f"prev_{status_filter}", disabled=current_page == 0,
+            on_click=_change_page, args=(status_filter, -1)
+        )
+    with col_p2:
+        st.write(f"Page {current_page + 1} / {total_pages}")
+    with col_p3:
+        st.button(
+            "Next", key=f"next_{status_filter}", disabled=current_page >= total_pages - 1,
+            on_click=_change_page, args=(status_filter, 1)
+        )
+
     # グリッド表示
-    selected_paths = []
+    # ページ内のサムネイルをまとめて並列取得しておく
+    thumb_map = prefetch_s3_images(
+        [img['path'] for img in display_images], loader=load_thumbnail
+    )
+
+    # ページ単位の一括選択 (各チェックボックスにデフォルト値を持たせない)
+    page_paths = [img['path'] for img in display_images]
+    select_all_key = f"selall_{status_filter}_{current_page}"
+    st.checkbox(
+        "Select all on this page",
+        key=select_all_key,
+        on_change=_apply_select_all,
+        args=(status_filter, select_all_key, page_paths)
+    )
+    selection = _selection_set(status_filter)
+
     cols = st.columns(4)
 
     for idx, img in enumerate(display_images):
         file_path = img['path'] # S3 Key
         with cols[idx % 4]:
-            try:
-                # S3から画像を取得して表示
-                img_bytes = load_s3_image(file_path)
-                st.image(img_bytes, width="stretch")
-
-                # 詳細ボタン
-                if st.button("🔍 Details", key=f"btn_det_{status_filter}_{start_idx + idx}"):
-                    view_image_details(
-                        img_bytes, # Pass bytes instead of path for display
-                        img.get('prompt', ''),
-                        img.get('tags', ''),
-                        img.get('keyword', '')
-                    )
+            # 取得に失敗した画像はprefetchの時点でNoneになっている
+            thumb_bytes = thumb_map.get(file_path)
+            if thumb_bytes is None:
+                st.error(f"Error loading {file_path}")
+                continue
 
-                unique_key = f"chk_{status_filter}_{file_path}"
-                default_val = status_filter == STATUS_UNPROCESSED
+            # S3から取得したサムネイルを表示
+            st.image(thumb_bytes, width="stretch")
 
-                is_selected = st.checkbox("Select", key=unique_key, value=default_val)
-                if is_selected:
-                    selected_paths.append(file_path)
+            # 詳細ボタン
+            if st.button("🔍 Details", key=f"btn_det_{status_filter}_{start_idx + idx}"):
+                view_image_details(
+                    file_path, # S3 Key (full-size bytes are loaded by the dialog)
+                    img.get('prompt', ''),
+                    img.get('tags', ''),
+                    img.get('keyword', '')
+                )
+
+            _render_select_checkbox(status_filter, file_path, selection)
+
+def _selection_set(status_filter) -> set:
+    """
+    選択中の画像(S3 Key)の集合。
+    ウィジェットの状態とは別に保持するため、ページを移動しても選択が残る。
+    """
+    return st.session_state.setdefault(f"selected_{status_filter}", set())
+
+
+def _render_select_checkbox(status_filter, file_path, selection):
+    """Render a tile's Select checkbox, initialised from the selection set."""
+    widget_key = f"chk_{status_filter}_{file_path}"
+    st.checkbox(
+        "Select",
+        key=widget_key,
+        value=file_path in selection,
+        on_change=_toggle_selection,
+        args=(status_filter, file_path, widget_key)
+    )
+
+
+def _change_page(status_filter, step):
+    """Prev/Next callback: move the gallery page index."""
+    st.session_state[f'page_{status_filter}'] += step
+
+
+def _toggle_selection(status_filter, file_path, widget_key):
+    """Checkbox callback: mirror the tile's value into the selection set."""
+    if st.session_state[widget_key]:
+        _selection_set(status_filter).add(file_path)
+    else:
+        _selection_set(status_filter).discard(file_path)
+
+
+def _apply_select_all(status_filter, select_all_key, page_paths):
+    """Select-all callback: apply the page-level checkbox value to each tile."""
+    selection = _selection_set(status_filter)
+    if st.session_state[select_all_key]:
+        selection.update(page_paths)
+    else:
+        selection.difference_update(page_paths)
+    # 各タイルのウィジェット状態を破棄し、次の描画で集合から初期化させる
+    for path in page_paths:
+        st.session_state.pop(f"chk_{status_filter}_{path}", None)
+
+
+def get_selection(status_filter):
+    """選択中の画像(S3 Key)のリストを返す"""
+    return list(_selection_set(status_filter))
 
-            except Exception as e: # pylint: disable=broad-exception-caught
-                st.error(f"Error loading {file_path}")
 
-    st.session_state[f'selection_{status_filter}'] = selected_paths
+def clear_selection(status_filter):
+    """アクション実行後に選択状態をリセットする"""
+    for path in _selection_set(status_filter):
+        st.session_state.pop(f"chk_{status_filter}_{path}", None)
+    st.session_state[f"selected_{status_filter}"] = set()
 
 
 def process_registration(keyword, status_filter=STATUS_UNPROCESSED):
     """
     Process selected images for registration.
     """
-    selected = st.session_state.get(f'selection_{status_filter}', [])
+    selected = get_selection(status_filter)
     if not selected:
         st.warning("No images selected.")
         return
 
-    submit_mgr = SubmissionManager(API_KEY)
-    state_mgr = StateManager()
+    state_mgr = get_state_mgr()
 
+    # 選択値はS3 Keyそのもの (DBのキー) なのでパス変換は不要
     target_images = []
     for path in selected:
-        rel_path = os.path.relpath(path, os.getcwd()).replace("\\", "/")
-        if rel_path in state_mgr.db:
-            data = state_mgr.db[rel_path].copy()
-            data['path'] = rel_path
-            target_images.append(data)
-
-    with st.spinner(f"Upscaling and Registering {len(target_images)} images..."):
-        zip_data = submit_mgr.process_submission(target_images, keyword=keyword)
-
-    if zip_data:
-        st.session_state['latest_zip_data'] = zip_data
-        st.session_state['latest_zip_name'] = (
-            f"submission_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
-        )
-        st.success("Registration Complete! Download ready.")
+        entry = state_mgr.db.get(path)
+        if entry is not None:
+            target_images.append({**entry, 'path': path})
+
+    if not target_images:
+        st.warning("Selected images were not found in DB.")
+        return
+
+    # アップスケール・ZIP作成はUIを止めないようバックグラウンドで実行する
+    # 生成ジョブと同様にプロセス共通のレジストリに登録し、再接続後も追跡できるようにする
+    job = SubmissionJob(API_KEY, target_images, keyword=keyword, state_mgr=state_mgr)
+    set_active_submission(get_job_registry().submit(job))
+    clear_selection(status_filter)
+    st.toast(f"Registering {len(target_images)} images in background...", icon="📤")
+    st.rerun()
+
+
+@st.fragment(run_every="1s")
+def _render_submission_status():
+    """
+    Poll the background submission job and publish the ZIP when it finishes.
+    """
+    job = get_active_submission()
+    if job is None:
+        return
+
+    status = job.status
+    if status['is_running']:
+        st.caption(status.get('message', 'Processing...'))
+        st.progress(status['progress'])
+        return
+
+    # 完了またはエラー: 結果を反映してアプリ全体を再描画する
+    clear_active_submission()
+    _clear_status_caches()
+    if status['zip_key']:
+        st.session_state['latest_zip_key'] = status['zip_key']
+        st.toast("Registration Complete! Download ready.", icon="✅")
     else:
-        st.error("Submission failed or no data.")
+        st.toast(f"Submission failed: {status.get('error') or 'no data'}", icon="⚠️")
+    st.rerun()
 
 
-def process_exclusion(status_filter=STATUS_UNPROCESSED):
+def _move_selection(status_filter, new_status, done_message):
     """
-    Process selected images to exclude them.
+    選択中の画像のステータスをnew_statusに変更する (除外・差し戻し共通)。
+    done_message: 件数を埋め込む完了メッセージ (e.g. "Excluded {} images.")
     """
-    selected = st.session_state.get(f'selection_{status_filter}', [])
+    selected = get_selection(status_filter)
     if not selected:
         st.warning("No images selected.")
         return
 
-    state_mgr = StateManager()
-    state_mgr.update_status(selected, STATUS_EXCLUDED)
-    st.success(f"Excluded {len(selected)} images.")
+    get_state_mgr().update_status(selected, new_status)
+    _clear_status_caches()
+    clear_selection(status_filter)
+    st.success(done_message.format(len(selected)))
+
+
+def process_exclusion(status_filter=STATUS_UNPROCESSED):
+    """
+    Process selected images to exclude them.
+    """
+    _move_selection(status_filter, STATUS_EXCLUDED, "Excluded {} images.")
 
 
 def process_revert(status_filter):
     """
     Revert selected images to unprocessed status.
     """
-    selected = st.session_state.get(f'selection_{status_filter}', [])
-    if not selected:
-        st.warning("No images selected.")
-        return
-
-    state_mgr = StateManager()
-    state_mgr.update_status(selected, STATUS_UNPROCESSED)
-    st.success(f"Reverted {len(selected)} images to Unprocessed.")
+    _move_selection(status_filter, STATUS_UNPROCESSED, "Reverted {} images to Unprocessed.")
 
 
 if __name__ == "__main__":
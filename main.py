@@ -8,7 +8,7 @@ and logging.
 import os
 import sys
 import argparse
-import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 import pandas as pd
 from dotenv import load_dotenv
@@ -20,6 +20,65 @@ from src.metadata import MetadataManager
 
 # pylint: disable=broad-exception-caught
 
+# 同時に処理するアイデア数の上限 (OpenAIへの同時リクエスト数を抑える)
+MAX_WORKERS = 8
+
+def process_idea(
+    i, idea, *, generator, processor, metadata_mgr, args, user_tags, images_dir, upscale_dir,
+    meta_executor
+): # pylint: disable=too-many-arguments
+    """
+    1つのアイデアについて 描画プロンプト生成 → 画像生成 → アップスケール → メタデータ生成 を行う。
+    メタデータは描画プロンプトだけに依存するため、meta_executor上で画像生成・アップスケールと並行して生成する。
+    Returns: CSV行 (dict)。失敗した場合はNone
+    """
+    try:
+        # 2. 描画プロンプト生成
+        draw_prompt = generator.generate_drawing_prompt(idea)
+
+        # 5. メタデータ生成 (画像生成・アップスケールと並行)
+        meta_future = meta_executor.submit(
+            metadata_mgr.get_image_metadata, draw_prompt, user_tags
+        )
+
+        # ファイル名設定
+        base_name = f"img_{i:03d}"
+        raw_filename = f"{base_name}.png"
+        raw_path = os.path.join(images_dir, raw_filename)
+
+        # 3. 画像生成
+        generator.generate_image(
+            prompt=draw_prompt,
+            output_path=raw_path,
+            size=args.size,
+            quality=args.quality,
+            response_format=args.response_format
+        )
+
+        # 4. アップスケール
+        # アップスケールファイル名形式: upscaled_000_YYYY... .png
+        time_short = datetime.now().strftime('%Y-%m-%dT%H-%M')
+        upscaled_filename = f"upscaled_{i:03d}_{time_short}.png"
+        upscaled_path = os.path.join(upscale_dir, upscaled_filename)
+
+        processor.upscale_image(raw_path, upscaled_path)
+
+        meta = meta_future.result()
+
+        # データ収集
+        return {
+            "filename": raw_filename,
+            "upscaled_filename": upscaled_filename,
+            "title": meta.get("title", ""),
+            "tags": meta.get("tags", ""),
+            "category": meta.get("category", 8),
+            "prompt": draw_prompt
+        }
+
+    except Exception as e:
+        print(f"アイデア {i} の処理中にエラーが発生しました: {e}")
+        return None
+
 def main(): # pylint: disable=too-many-locals, too-many-statements
     """
     Main function for CLI execution.
@@ -106,8 +165,8 @@ def main(): # pylint: disable=too-many-locals, too-many-statements
 - **Output Dir**: {base_output_dir}
 """
     try:
-        from src.storage import S3Manager
-        s3 = S3Manager()
+        from src.storage import get_s3_manager
+        s3 = get_s3_manager()
         current_history = ""
         if s3.file_exists(history_key):
             current_history = s3.read_text(history_key)
@@ -124,53 +183,32 @@ def main(): # pylint: disable=too-many-locals, too-many-statements
         args.keyword, n_ideas=args.n, style=args.style
     )
 
+    # 2-5. アイデアごとの処理 (ネットワーク待ちが主なのでスレッドで並列実行)
     csv_data = []
-
-    for i, idea in enumerate(tqdm(ideas, desc="処理中")):
-        try:
-            # 2. 描画プロンプト生成
-            draw_prompt = generator.generate_drawing_prompt(idea)
-
-            # ファイル名設定
-            base_name = f"img_{i:03d}"
-            raw_filename = f"{base_name}.png"
-            raw_path = os.path.join(images_dir, raw_filename)
-
-            # 3. 画像生成
-            generator.generate_image(
-                prompt=draw_prompt,
-                output_path=raw_path,
-                size=args.size,
-                quality=args.quality,
-                response_format=args.response_format
+    n_workers = min(MAX_WORKERS, max(len(ideas), 1))
+    with ThreadPoolExecutor(max_workers=n_workers) as meta_executor, \
+            ThreadPoolExecutor(max_workers=n_workers) as executor:
+        futures = [
+            executor.submit(
+                process_idea, i, idea,
+                generator=generator,
+                processor=processor,
+                metadata_mgr=metadata_mgr,
+                args=args,
+                user_tags=user_tags,
+                images_dir=images_dir,
+                upscale_dir=upscale_dir,
+                meta_executor=meta_executor
             )
-
-            # 4. アップスケール
-            # アップスケールファイル名形式: upscaled_000_YYYY... .png
-            time_short = datetime.now().strftime('%Y-%m-%dT%H-%M')
-            upscaled_filename = f"upscaled_{i:03d}_{time_short}.png"
-            upscaled_path = os.path.join(upscale_dir, upscaled_filename)
-
-            processor.upscale_image(raw_path, upscaled_path)
-
-            # 5. メタデータ生成
-            meta = metadata_mgr.get_image_metadata(draw_prompt, user_tags)
-
-            # データ収集
-            csv_data.append({
-                "filename": raw_filename,
-                "upscaled_filename": upscaled_filename,
-                "title": meta.get("title", ""),
-                "tags": meta.get("tags", ""),
-                "category": meta.get("category", 8),
-                "prompt": draw_prompt
-            })
-
-            # レート制限回避のため待機
-            time.sleep(1)
-
-        except Exception as e:
-            print(f"アイデア {i} の処理中にエラーが発生しました: {e}")
+            for i, idea in enumerate(ideas)
+        ]
+        for future in tqdm(as_completed(futures), total=len(futures), desc="処理中"):
+            row = future.result()
+            if row:
+                csv_data.append(row)
+
+    # 完了順ではなくファイル名順で出力する
+    csv_data.sort(key=lambda row: row["filename"])
 
     # 6. CSV出力
     if not csv_data:
@@ -3,22 +3,113 @@ Image Generator Module.
 
 Interacts with OpenAI API to generate image descriptions, prompts, and images.
 """
+import os
 import json
 import base64
+import hashlib
+import tempfile
+import threading
+from functools import lru_cache
 from typing import List, Dict, Optional
 import requests
-from openai import OpenAI
+from diskcache import Cache
+from src.openai_client import get_openai_client
 from src.styles import STYLE_DEFINITIONS
+from src.thumbnails import make_thumbnail, thumbnail_key
 
 # pylint: disable=broad-exception-caught
 
+# 画像生成APIへの同時リクエスト数の上限 (プロセス全体で共有)
+# 複数ジョブが並列に走ってもOpenAIのレート制限を超えにくくする
+IMAGE_CONCURRENCY = 5
+_image_semaphore = threading.BoundedSemaphore(IMAGE_CONCURRENCY)
+
+# URL形式のレスポンスの画像取得に使うセッション (接続を使い回す)
+_http_session = requests.Session()
+_http_session.mount(
+    "https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16)
+)
+
+# アイデア・描画プロンプト生成のデフォルトモデル
+# スキーマ固定の構造化出力なので小さいモデルで十分、ジョブの立ち上がりも速くなる
+TEXT_MODEL = "gpt-4o-mini"
+
+PROMPT_CACHE_DIR = os.path.join(tempfile.gettempdir(), "as_prompt_cache")
+
+@lru_cache(maxsize=None)
+def _prompt_cache() -> Cache:
+    """
+    描画プロンプトのディスクキャッシュ (完全一致のみ)。
+    同じ説明・スタイルの再生成 (エラー後のやり直し等) でgpt-4oの呼び出しを省く。
+    """
+    return Cache(PROMPT_CACHE_DIR, size_limit=64 * 1024 ** 2, eviction_policy="least-recently-used")
+
+# 関数定義 (tools) はリクエストごとに作り直さない
+_DRAWING_TOOLS = [
+    {
+        "type": "function",
+        "function": {
+            "name": "set_drawing_prompt",
+            "description": "英語の描画プロンプトを設定します。",
+            "strict": True,
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "prompt": {"type": "string"}
+                },
+                "required": ["prompt"],
+                "additionalProperties": False,
+            },
+        },
+    }
+]
+
+@lru_cache(maxsize=32)
+def _idea_tools(n_ideas: int) -> list:
+    """アイデア生成用のtools定義 (n_ideasごとに1度だけ作成。呼び出し側で変更しないこと)"""
+    return [
+        {
+            "type": "function",
+            "function": {
+                "name": "set_image_descriptions",
+                "description": f"{n_ideas}個の異なる画像説明を生成します。",
+                "strict": True,
+                "parameters": {
+                    "type": "object",
+                    "properties": {
+                        "descriptions": {
+                            "type": "array",
+                            "items": {"type": "string"},
+                            "description": "画像説明のリスト。"
+                        }
+                    },
+                    "required": ["descriptions"],
+                    "additionalProperties": False,
+                },
+            },
+        }
+    ]
+
 class ImageGenerator:
     """
     Class for generating images via OpenAI API.
     """
-    def __init__(self, api_key: str, model_name: str = "dall-e-3"):
-        self.client = OpenAI(api_key=api_key)
+    def __init__(
+        self, api_key: str, model_name: str = "dall-e-3", text_model: str = TEXT_MODEL
+    ):
+        self.client = get_openai_client(api_key)
         self.model_name = model_name
+        # アイデア・描画プロンプト生成に使うチャットモデル (品質重視なら"gpt-4o"を指定)
+        self.text_model = text_model
+        self._s3 = None
+
+    @property
+    def s3(self):
+        """画像の保存先S3Manager (初回アクセス時に作成し、以降は使い回す)"""
+        if self._s3 is None:
+            from src.storage import get_s3_manager
+            self._s3 = get_s3_manager()
+        return self._s3
 
     def generate_image_description(
         self, keyword: str, n_ideas: int = 10, style: str = "japanese_simple"
@@ -26,30 +117,10 @@ class ImageGenerator:
         """
         キーワードに基づいて、異なる画像の説明（シードプロンプト）を生成します。
         """
-        tools = [
-            {
-                "type": "function",
-                "function": {
-                    "name": "set_image_descriptions",
-                    "description": f"{n_ideas}個の異なる画像説明を生成します。",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "descriptions": {
-                                "type": "array",
-                                "items": {"type": "string"},
-                                "description": "画像説明のリスト。"
-                            }
-                        },
-                        "required": ["descriptions"],
-                        "additionalProperties": False,
-                    },
-                },
-            }
-        ]
+        tools = _idea_tools(n_ideas)
 
-        if style in STYLE_DEFINITIONS:
-            style_info = STYLE_DEFINITIONS[style]
+        style_info = STYLE_DEFINITIONS.get(style)
+        if style_info:
             style_prompt = style_info.get("idea_prompt", "")
             
             prompt_content = f"""
@@ -73,7 +144,7 @@ class ImageGenerator:
 
         try:
             completion = self.client.chat.completions.create(
-                model="gpt-4o",
+                model=self.text_model,
                 messages=[{"role": "user", "content": prompt_content}],
                 tools=tools,
                 tool_choice={
@@ -99,44 +170,36 @@ class ImageGenerator:
 
         # スタイル制約を取得
         # default
-        style_constraints = (
+        style_info = STYLE_DEFINITIONS.get(style)
+        style_constraints = style_info["drawing_prompt"] if style_info else (
             "Minimalist Japanese line art, simple, clean lines. White background. No text."
         )
-        if style in STYLE_DEFINITIONS:
-            style_constraints = STYLE_DEFINITIONS[style]["drawing_prompt"]
-
-        tools = [
-            {
-                "type": "function",
-                "function": {
-                    "name": "set_drawing_prompt",
-                    "description": "英語の描画プロンプトを設定します。",
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "prompt": {"type": "string"}
-                        },
-                        "required": ["prompt"],
-                        "additionalProperties": False,
-                    },
-                },
-            }
-        ]
 
-        content = f"""
+        # 指示とスタイル制約は同じスタイルの間は不変なのでsystemメッセージとして先頭に置き、
+        # OpenAIのプロンプトキャッシュが効くようにする
+        instructions = f"""
         Translate the following image description into a detailed English prompt (~100 words).
         Focus on visual details, style, and composition. Do NOT include instructions like "create an image".
         
-        Original Description: {seed_description}
-        
         Style constraints: {style_constraints}
         """
+        content = f"Original Description: {seed_description}"
+
+        cache_key = hashlib.sha256(
+            json.dumps([self.text_model, instructions, content], ensure_ascii=False).encode()
+        ).hexdigest()
+        cached = _prompt_cache().get(cache_key)
+        if cached is not None:
+            return cached
 
         try:
             completion = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[{"role": "user", "content": content}],
-                tools=tools,
+                model=self.text_model,
+                messages=[
+                    {"role": "system", "content": instructions},
+                    {"role": "user", "content": content}
+                ],
+                tools=_DRAWING_TOOLS,
                 tool_choice={
                     "type": "function",
                     "function": {"name": "set_drawing_prompt"}
@@ -145,6 +208,8 @@ class ImageGenerator:
             args = json.loads(
                 completion.choices[0].message.tool_calls[0].function.arguments
             )
+            if args["prompt"]:
+                _prompt_cache().set(cache_key, args["prompt"])
             return args["prompt"]
         except Exception as e:
             print(f"描画プロンプト生成エラー: {e}")
@@ -161,12 +226,14 @@ class ImageGenerator:
         size: Optional[str] = None,
         quality: Optional[str] = None,
         n: int = 1,
-        response_format: Optional[str] = None
+        response_format: Optional[str] = None,
+        async_upload: bool = False
     ): # pylint: disable=too-many-arguments, too-many-positional-arguments, too-many-locals
         """
         Generate an image using OpenAI API and upload to S3.
         指定されたOpenAIモデルを使用して画像を生成し、S3に保存します。
         output_path: S3 Key (e.g. "output/timestamp_keyword/generated_images/img_001.png")
+        async_upload: Trueの場合はアップロード完了を待たず、S3 Keyを返すFutureを返す
         """
         try:
             # パラメータを動的に構築 (NoneのものはAPIに送らない)
@@ -183,7 +250,8 @@ class ImageGenerator:
                 params["response_format"] = response_format
 
             print(f"Generating image with params: {params}")
-            response = self.client.images.generate(**params)
+            with _image_semaphore:
+                response = self.client.images.generate(**params)
 
             image_item = response.data[0]
 
@@ -198,17 +266,27 @@ class ImageGenerator:
             if not is_b64:
                 # url case
                 if image_content:
-                    img_bytes = requests.get(image_content, timeout=60).content
+                    img_bytes = _http_session.get(image_content, timeout=60).content
             else:
                 # b64_json case
                 img_bytes = base64.b64decode(image_content)
 
             if img_bytes:
                 # S3にアップロード
-                from src.storage import S3Manager
-                s3 = S3Manager()
+                s3 = self.s3
+                # サムネイルは本体の保存に成功した後にだけ保存する
+                # (本体が無いサムネイルをthumbs/に残さない)
+                if async_upload:
+                    def _on_uploaded(future):
+                        if future.exception() is None:
+                            self._upload_thumbnail(s3, img_bytes, output_path)
+
+                    upload = s3.upload_file_async(img_bytes, output_path, content_type="image/png")
+                    upload.add_done_callback(_on_uploaded)
+                    return upload
                 s3.upload_file(img_bytes, output_path, content_type="image/png")
                 print(f"画像をS3に保存しました: {output_path}")
+                self._upload_thumbnail(s3, img_bytes, output_path)
                 return output_path
             
             raise ValueError("API returned no recognized image data (url or b64_json)")
@@ -216,3 +294,16 @@ class ImageGenerator:
         except Exception as e:
             print(f"モデル {self.model_name} での画像生成エラー: {e}")
             raise e
+
+    @staticmethod
+    def _upload_thumbnail(s3, img_bytes: bytes, output_path: str):
+        """
+        ギャラリー表示用のサムネイルを作成し、バックグラウンドでS3へ保存する。
+        失敗しても本体の保存には影響させない (表示側でフルサイズから再作成される)。
+        """
+        try:
+            s3.upload_file_async(
+                make_thumbnail(img_bytes), thumbnail_key(output_path), content_type="image/webp"
+            )
+        except Exception as e:
+            print(f"Thumbnail Error: {e}")
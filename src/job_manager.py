@@ -3,17 +3,31 @@ Job Manager Module.
 
 Handles asynchronous background jobs for image generation.
 """
+import csv
+import re
 import threading
 import time
 import traceback
-from typing import Dict, Optional, Any
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Any, Tuple
 from datetime import datetime
 
 from src.generator import ImageGenerator
 from src.state_manager import StateManager
-from src.storage import S3Manager
-import pandas as pd
-from io import BytesIO
+from src.submission_manager import SubmissionManager
+from src.storage import get_s3_manager
+from io import BytesIO, TextIOWrapper
+
+# Upper bound on concurrent OpenAI requests per job
+MAX_WORKERS = 8
+
+# Characters other than (Unicode) alphanumerics, space, '_' and '-'
+_UNSAFE_KEYWORD_CHARS = re.compile(r"[^\w \-]")
+
+def make_safe_keyword(keyword: str, max_len: int = 50) -> str:
+    """Sanitize a keyword for use in an S3 prefix."""
+    return _UNSAFE_KEYWORD_CHARS.sub("", keyword).strip().replace(" ", "_")[:max_len]
 
 class GenerationJob(threading.Thread):
     """
@@ -28,7 +42,9 @@ class GenerationJob(threading.Thread):
         model: str,
         style: str,
         size: str,
-        creator_ip: str = "127.0.0.1"
+        creator_ip: str = "127.0.0.1",
+        generator: Optional[ImageGenerator] = None,
+        state_mgr: Optional[StateManager] = None
     ):
         super().__init__()
         self.api_key = api_key
@@ -39,6 +55,9 @@ class GenerationJob(threading.Thread):
         self.style = style
         self.size = size
         self.creator_ip = creator_ip
+        # 呼び出し側でキャッシュ済みのインスタンスがあれば再利用する
+        self.generator = generator
+        self.state_mgr = state_mgr
         
         self._stop_event = threading.Event()
         self.status = {
@@ -56,16 +75,14 @@ class GenerationJob(threading.Thread):
         self.status["message"] = "Starting generation..."
         
         try:
-            generator = ImageGenerator(self.api_key, model_name=self.model)
+            generator = self.generator or ImageGenerator(self.api_key, model_name=self.model)
 
             # 1. Setup Directories
             # Copied logic from app.py _setup_output_dirs to keep it self-contained or importable
             # For simplicity, we implement logic here or import if it was in a shared util.
             # Let's replicate the logic to ensure thread safety without relying on st context
             timestamp = datetime.now().strftime('%Y-%m-%dT%H-%M-%S')
-            safe_keyword = "".join(
-                c for c in self.keyword if c.isalnum() or c in (' ', '_', '-')
-            ).strip().replace(" ", "_")[:50]
+            safe_keyword = make_safe_keyword(self.keyword)
             base_prefix = f"output/{timestamp}_{safe_keyword}"
             images_dir = f"{base_prefix}/generated_images"
 
@@ -83,57 +100,55 @@ class GenerationJob(threading.Thread):
             if not ideas:
                 raise ValueError("Failed to generate ideas.")
 
-            # 3. Generate Images Loop
+            # 3. Generate Images Loop (ideas are processed concurrently)
             csv_data = []
+            pending_uploads = []
             total_steps = len(ideas)
-            
-            for i, idea in enumerate(ideas):
-                if self._stop_event.is_set():
-                    self.status["message"] = "Cancelled."
-                    break
+            done_steps = 0
 
-                self.status["message"] = f"Generating image {i+1}/{self.n_images}..."
-                # Progress calculation: 0.1 to 0.9
-                self.status["progress"] = 0.1 + (0.8 * (i / total_steps))
+            with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, total_steps)) as executor:
+                futures = [
+                    executor.submit(self._generate_one, generator, i, idea, images_dir)
+                    for i, idea in enumerate(ideas)
+                ]
+                for future in as_completed(futures):
+                    done_steps += 1
+                    # Progress calculation: 0.1 to 0.9
+                    self.status["progress"] = 0.1 + (0.8 * (done_steps / total_steps))
+                    self.status["message"] = f"Generated {done_steps}/{total_steps} images..."
 
+                    result = future.result()
+                    if result:
+                        pending_uploads.append(result)
+
+            # Wait for the S3 uploads that overlapped with generation
+            for row, upload in pending_uploads:
                 try:
-                    draw_prompt = generator.generate_drawing_prompt(idea, style=self.style)
-                    filename = f"img_{i:03d}.png"
-                    output_path = f"{images_dir}/{filename}"
-
-                    generator.generate_image(
-                        prompt=draw_prompt,
-                        output_path=output_path,
-                        size=self.size
-                    )
-                    
-                    csv_data.append({
-                        "filename": filename,
-                        "prompt": draw_prompt,
-                        "keyword": self.keyword,
-                        "tags": self.tags,
-                        "creator_ip": self.creator_ip
-                    })
+                    upload.result()
+                    csv_data.append(row)
                     self.status["generated_count"] += 1
-                    
                 except Exception as e:
-                    print(f"Error in job: {e}")
-                    # Continue to next image even if one fails
+                    print(f"Upload error in job: {e}")
+
+            if self._stop_event.is_set():
+                self.status["message"] = "Cancelled."
+
+            # Keep prompt.csv ordered by filename regardless of completion order
+            csv_data.sort(key=lambda row: row["filename"])
 
             # 4. Finalize
             if csv_data:
                 self.status["message"] = "Saving metadata..."
                 self.status["progress"] = 0.95
                 
-                s3 = S3Manager()
-                df = pd.DataFrame(csv_data)
-                csv_buffer = BytesIO()
-                df.to_csv(csv_buffer, index=False, encoding='utf-8-sig')
+                s3 = get_s3_manager()
                 csv_key = f"{images_dir}/prompt.csv"
-                s3.upload_file(csv_buffer.getvalue(), csv_key, content_type="text/csv")
+                s3.upload_file(self._build_prompt_csv(csv_data), csv_key, content_type="text/csv")
                 
-                # Update State DB
-                StateManager().scan_and_sync()
+                # Update State DB (このジョブのバッチのみをスキャンする)
+                (self.state_mgr or StateManager(scan=False)).scan_and_sync(
+                    batch_prefixes=[f"{base_prefix}/"]
+                )
 
             self.status["progress"] = 1.0
             self.status["message"] = "Generation Complete!"
@@ -146,6 +161,149 @@ class GenerationJob(threading.Thread):
         finally:
             self.status["is_running"] = False
 
+    def _build_prompt_csv(self, rows: List[Dict[str, Any]]) -> BytesIO:
+        """
+        prompt.csvを作成する (DataFrameを介さず1行ずつ書き出す)。
+        ジョブ共通の値 (keyword, tags, creator_ip) は書き出し時に付与する。
+        文字列全体のコピー・エンコードを挟まず、UTF-8 (BOM付き) のバイト列へ直接書き込む。
+        Returns: 先頭に巻き戻したBytesIO (そのままupload_fileに渡せる)
+        """
+        common = {"keyword": self.keyword, "tags": self.tags, "creator_ip": self.creator_ip}
+        text = TextIOWrapper(BytesIO(), encoding="utf-8-sig", newline="")
+        writer = csv.DictWriter(
+            text, fieldnames=["filename", "prompt", *common], lineterminator="\n"
+        )
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({**row, **common})
+        text.flush()
+        buffer = text.detach()
+        buffer.seek(0)
+        return buffer
+
+    def _generate_one(
+        self, generator: ImageGenerator, i: int, idea: str, images_dir: str
+    ) -> Optional[Tuple[Dict[str, Any], Future]]:
+        """
+        Generate a single image for an idea.
+        Returns (CSV row, upload Future), or None on failure.
+        """
+        if self._stop_event.is_set():
+            return None
+
+        try:
+            draw_prompt = generator.generate_drawing_prompt(idea, style=self.style)
+            filename = f"img_{i:03d}.png"
+            output_path = f"{images_dir}/{filename}"
+
+            upload = generator.generate_image(
+                prompt=draw_prompt,
+                output_path=output_path,
+                size=self.size,
+                async_upload=True
+            )
+
+            return {
+                "filename": filename,
+                "prompt": draw_prompt
+            }, upload
+
+        except Exception as e:
+            print(f"Error in job: {e}")
+            # Continue to next image even if one fails
+            return None
+
     def cancel(self):
         """Request job cancellation."""
         self._stop_event.set()
+
+
+class SubmissionJob(threading.Thread):
+    """
+    Background job for upscaling and registering selected images.
+    """
+    def __init__(
+        self,
+        api_key: str,
+        target_images: List[Dict[str, Any]],
+        keyword: str = "batch",
+        state_mgr: Optional[StateManager] = None
+    ):
+        super().__init__()
+        self.api_key = api_key
+        self.target_images = target_images
+        self.keyword = keyword
+        self.state_mgr = state_mgr
+
+        self.status = {
+            "progress": 0.0,
+            "message": "Initializing...",
+            "is_running": False,
+            "is_complete": False,
+            "error": None,
+            "zip_key": None
+        }
+
+    def run(self):
+        """Execute the submission process."""
+        self.status["is_running"] = True
+        total = len(self.target_images)
+        self.status["message"] = f"Registering {total} images..."
+
+        try:
+            submit_mgr = SubmissionManager(self.api_key, state_mgr=self.state_mgr)
+            zip_key = submit_mgr.process_submission(
+                self.target_images,
+                keyword=self.keyword,
+                progress_callback=self._on_progress
+            )
+            if not zip_key:
+                raise ValueError("Submission failed or no data.")
+
+            self.status["zip_key"] = zip_key
+            self.status["progress"] = 1.0
+            self.status["message"] = "Registration Complete!"
+            self.status["is_complete"] = True
+
+        except Exception as e:
+            self.status["error"] = str(e)
+            self.status["message"] = f"Error: {str(e)}"
+            traceback.print_exc()
+        finally:
+            self.status["is_running"] = False
+
+    def _on_progress(self, done: int, total: int):
+        """Progress callback for SubmissionManager.process_submission."""
+        self.status["progress"] = done / total
+        self.status["message"] = f"Registered {done}/{total} images..."
+
+
+class JobRegistry:
+    """
+    Process-wide registry of background jobs keyed by job id.
+    Sessions only keep the id, so a job outlives the session that started it
+    (e.g. after a websocket reconnect) and can be looked up again.
+    """
+    def __init__(self):
+        self._jobs: Dict[str, threading.Thread] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, job: threading.Thread) -> str:
+        """Register and start a job. Returns its id."""
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._jobs[job_id] = job
+        job.start()
+        return job_id
+
+    def get(self, job_id: Optional[str]) -> Optional[threading.Thread]:
+        """Return the job for the id, or None if unknown."""
+        if not job_id:
+            return None
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def remove(self, job_id: Optional[str]):
+        """Forget a finished job."""
+        with self._lock:
+            self._jobs.pop(job_id, None)
@@ -6,86 +6,237 @@ and exports CSV files for Adobe Stock submission.
 """
 import os
 import json
-from typing import Dict, List, Any
+import hashlib
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, List, Any, Optional, Tuple
 import pandas as pd
-from openai import OpenAI
+from diskcache import Cache
+from src.openai_client import get_openai_client
 
 # pylint: disable=broad-exception-caught
 
+METADATA_MODEL = "gpt-4o"
+METADATA_CACHE_DIR = os.path.join(tempfile.gettempdir(), "as_meta_cache")
+# 同じ画像の再提出 (エラー後のやり直し等) をカバーできる期間
+METADATA_CACHE_TTL = 7 * 86400
+
+# 1リクエストでメタデータを生成する画像数の上限 (出力トークンが長くなりすぎないように)
+METADATA_BATCH_SIZE = 10
+# 同時に送るバッチリクエスト数の上限 (レート制限を超えにくくする)
+METADATA_CONCURRENCY = 4
+
+# コンテキスト用のカテゴリリスト（短縮版）
+CATEGORIES_TEXT = """
+1: 動物, 2: 建物・建築, 3: ビジネス, 4: 飲み物, 5: 環境, 6: 心の状態, 7: 料理・食品, 
+8: グラフィック素材, 9: 趣味・レジャー, 10: 産業, 11: 風景, 12: ライフスタイル, 13: 人物, 
+14: 植物・花, 15: 文化・宗教, 16: 科学, 17: 社会問題, 18: スポーツ, 19: テクノロジー, 20: 交通・乗り物, 21: 旅行
+"""
+
+# 全リクエスト共通の指示はsystemメッセージとして先頭に置く
+# (プロンプトの先頭が毎回同一になり、OpenAIのプロンプトキャッシュが効く)
+METADATA_INSTRUCTIONS = f"""
+あなたは熟練したAdobe Stockのコントリビューターです。与えられたプロンプトから生成された画像のメタデータ（日本語）を生成してください。
+
+要件:
+1. タイトル: 説明的で自然な日本語。
+2. タグ: 30〜40個程度。ユーザー指定の必須タグが関連する場合は必ず含めてください。重複は避けてください。
+3. カテゴリ: 次の中から最も適切なIDを選択してください: {CATEGORIES_TEXT}
+"""
+
+_METADATA_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "title": {
+            "type": "string",
+            "description": "簡潔で説明的な日本語のタイトル（20〜30文字程度）。"
+        },
+        "tags": {
+            "type": "string",
+            "description": "30〜40個の日本語タグのカンマ区切りリスト。"
+        },
+        "category": {
+            "type": "integer",
+            "description": "Adobe Stock カテゴリID (1-21)。"
+        }
+    },
+    "required": ["title", "tags", "category"],
+    "additionalProperties": False,
+}
+
+def _cache_key(generation_prompt: str, user_tags: List[str]) -> str:
+    """メタデータキャッシュのキー (モデル・プロンプト・タグのSHA-256)"""
+    return hashlib.sha256(
+        json.dumps([METADATA_MODEL, generation_prompt, user_tags], ensure_ascii=False).encode()
+    ).hexdigest()
+
+@lru_cache(maxsize=None)
+def _metadata_cache() -> Cache:
+    """生成済みメタデータのディスクキャッシュ (プロセス間・再起動後も共有)"""
+    return Cache(METADATA_CACHE_DIR, size_limit=64 * 1024 ** 2)
+
 class MetadataManager:
     """
     Manages image metadata generation and CSV export.
     """
     def __init__(self, api_key: str):
-        self.client = OpenAI(api_key=api_key)
+        self.client = get_openai_client(api_key)
 
     def get_image_metadata(
         self, generation_prompt: str, user_tags: List[str]
     ) -> Dict[str, Any]:
         """
         Adobe Stock用のタイトル、タグ、カテゴリを生成します。
+        同じプロンプト・タグの組み合わせはキャッシュから返し、APIを呼ばない。
         """
+        cache_key = _cache_key(generation_prompt, user_tags)
+        cached = _metadata_cache().get(cache_key)
+        if cached is not None:
+            return cached
+
         tools = [
             {
                 "type": "function",
                 "function": {
                     "name": "set_image_metadata",
                     "description": "Adobe Stock提出用のメタデータを設定します。",
+                    "strict": True,
+                    "parameters": _METADATA_SCHEMA,
+                },
+            }
+        ]
+
+        content = f"""
+プロンプト: "{generation_prompt}"
+必須タグ: {', '.join(user_tags) or "なし"}
+"""
+
+        try:
+            completion = self.client.chat.completions.create(
+                model=METADATA_MODEL,
+                messages=[
+                    {"role": "system", "content": METADATA_INSTRUCTIONS},
+                    {"role": "user", "content": content}
+                ],
+                tools=tools,
+                tool_choice={"type": "function", "function": {"name": "set_image_metadata"}},
+            )
+            args = json.loads(
+                completion.choices[0].message.tool_calls[0].function.arguments
+            )
+            # フォールバック値はキャッシュしない (次回は再度APIを試す)
+            _metadata_cache().set(cache_key, args, expire=METADATA_CACHE_TTL)
+            return args
+        except Exception as e:
+            print(f"メタデータ生成エラー: {e}")
+            # 失敗時のフォールバック
+            return {"title": "タイトル生成エラー", "tags": ",".join(user_tags), "category": 8}
+
+    def get_images_metadata(
+        self, items: List[Tuple[str, List[str]]]
+    ) -> List[Dict[str, Any]]:
+        """
+        複数画像のメタデータをまとめて生成します。
+        items: (generation_prompt, user_tags) のリスト
+        Returns: itemsと同じ順序のメタデータのリスト
+        同じプロンプト・タグの組み合わせは1件として扱い、
+        キャッシュに無いものだけをMETADATA_BATCH_SIZE件ずつ1リクエストで生成し、
+        件数が合わない等で失敗したバッチは1件ずつのget_image_metadataで再生成する。
+        """
+        cache = _metadata_cache()
+        keys = [_cache_key(prompt, tags) for prompt, tags in items]
+        # キー -> 最初に現れたitemsの位置 (重複分はAPIに送らない)
+        first_index: Dict[str, int] = {}
+        for i, key in enumerate(keys):
+            first_index.setdefault(key, i)
+        metas: Dict[str, Optional[Dict[str, Any]]] = {
+            key: cache.get(key) for key in first_index
+        }
+        missing = [first_index[key] for key, meta in metas.items() if meta is None]
+        chunks = [
+            missing[start:start + METADATA_BATCH_SIZE]
+            for start in range(0, len(missing), METADATA_BATCH_SIZE)
+        ]
+
+        def _fill_chunk(chunk: List[int]):
+            batch = self._request_metadata_batch([items[i] for i in chunk])
+            for pos, i in enumerate(chunk):
+                prompt, tags = items[i]
+                if batch is None:
+                    metas[keys[i]] = self.get_image_metadata(prompt, tags)
+                else:
+                    metas[keys[i]] = batch[pos]
+                    cache.set(keys[i], batch[pos], expire=METADATA_CACHE_TTL)
+
+        # 各バッチのリクエストは独立しているので並列に送る (待ち時間はほぼネットワーク)
+        if chunks:
+            with ThreadPoolExecutor(max_workers=min(METADATA_CONCURRENCY, len(chunks))) as ex:
+                list(ex.map(_fill_chunk, chunks))
+        return [metas[key] for key in keys]
+
+    def _request_metadata_batch(
+        self, items: List[Tuple[str, List[str]]]
+    ) -> Optional[List[Dict[str, Any]]]:
+        """
+        1リクエストで複数画像のメタデータを生成する。
+        Returns: itemsと同じ件数のリスト。失敗時はNone
+        """
+        n = len(items)
+        tools = [
+            {
+                "type": "function",
+                "function": {
+                    "name": "set_images_metadata",
+                    "description": "複数画像のAdobe Stock提出用メタデータを番号順に設定します。",
+                    "strict": True,
                     "parameters": {
                         "type": "object",
                         "properties": {
-                            "title": {
-                                "type": "string",
-                                "description": "簡潔で説明的な日本語のタイトル（20〜30文字程度）。"
-                            },
-                            "tags": {
-                                "type": "string",
-                                "description": "30〜40個の日本語タグのカンマ区切りリスト。"
-                            },
-                            "category": {
-                                "type": "integer",
-                                "description": "Adobe Stock カテゴリID (1-21)。"
+                            "items": {
+                                "type": "array",
+                                "items": _METADATA_SCHEMA,
+                                "minItems": n,
+                                "maxItems": n,
                             }
                         },
-                        "required": ["title", "tags", "category"],
+                        "required": ["items"],
                         "additionalProperties": False,
                     },
                 },
             }
         ]
 
-        # コンテキスト用のカテゴリリスト（短縮版）
-        categories_text = """
-        1: 動物, 2: 建物・建築, 3: ビジネス, 4: 飲み物, 5: 環境, 6: 心の状態, 7: 料理・食品, 
-        8: グラフィック素材, 9: 趣味・レジャー, 10: 産業, 11: 風景, 12: ライフスタイル, 13: 人物, 
-        14: 植物・花, 15: 文化・宗教, 16: 科学, 17: 社会問題, 18: スポーツ, 19: テクノロジー, 20: 交通・乗り物, 21: 旅行
-        """
-
+        prompts_text = "\n".join(
+            f'{i + 1}. "{prompt}" (必須タグ: {", ".join(tags) or "なし"})'
+            for i, (prompt, tags) in enumerate(items)
+        )
         content = f"""
-        あなたは熟練したAdobe Stockのコントリビューターです。このプロンプトから生成された画像のメタデータ（日本語）を生成してください：
-        "{generation_prompt}"
-
-        要件:
-        1. タイトル: 説明的で自然な日本語。
-        2. タグ: 30〜40個程度。ユーザー指定の必須タグが関連する場合は必ず含めてください: {', '.join(user_tags)}。重複は避けてください。
-        3. カテゴリ: 次の中から最も適切なIDを選択してください: {categories_text}
-        """
+次の{n}個のプロンプトそれぞれについて、番号順に{n}件のメタデータを生成してください：
+{prompts_text}
+"""
 
         try:
             completion = self.client.chat.completions.create(
-                model="gpt-4o",
-                messages=[{"role": "user", "content": content}],
+                model=METADATA_MODEL,
+                messages=[
+                    {"role": "system", "content": METADATA_INSTRUCTIONS},
+                    {"role": "user", "content": content}
+                ],
                 tools=tools,
-                tool_choice={"type": "function", "function": {"name": "set_image_metadata"}},
+                tool_choice={"type": "function", "function": {"name": "set_images_metadata"}},
             )
             args = json.loads(
                 completion.choices[0].message.tool_calls[0].function.arguments
             )
-            return args
+            metas = args.get("items", [])
+            if len(metas) != n:
+                print(f"メタデータ一括生成の件数不一致: {len(metas)}/{n}")
+                return None
+            return metas
         except Exception as e:
-            print(f"メタデータ生成エラー: {e}")
-            # 失敗時のフォールバック
-            return {"title": "タイトル生成エラー", "tags": ",".join(user_tags), "category": 8}
+            print(f"メタデータ一括生成エラー: {e}")
+            return None
 
     def export_csvs(self, data_rows: List[Dict], output_folder: str):
         """
@@ -93,24 +244,22 @@ class MetadataManager:
         data_rows は 'filename', 'upscaled_filename', 'title', 'tags',
         'category', 'prompt' を含む必要があります。
         """
+        df = pd.DataFrame(data_rows)
+
         # prompt.csv
         # main.py とは別に、提出ディレクトリ用バックアップとして保存
-        prompt_df = pd.DataFrame(data_rows)[['filename', 'prompt']]
+        prompt_df = df[['filename', 'prompt']]
         prompt_csv_path = os.path.join(output_folder, "prompt_backup.csv")
         prompt_df.to_csv(prompt_csv_path, index=False, encoding='utf-8-sig')
 
         # submit.csv
-        # 形式: Filename, Title, Keywords, Category
-        submit_data = []
-        for row in data_rows:
-            submit_data.append({
-                "Filename": row['upscaled_filename'],
-                "Title": row['title'],
-                "Keywords": row['tags'],
-                "Category": row['category']
-            })
-
-        submit_df = pd.DataFrame(submit_data)
+        # 形式: Filename, Title, Keywords, Category (行ループではなく列の選択・リネームで作成)
+        submit_df = df[['upscaled_filename', 'title', 'tags', 'category']].rename(columns={
+            'upscaled_filename': 'Filename',
+            'title': 'Title',
+            'tags': 'Keywords',
+            'category': 'Category'
+        })
         submit_csv_path = os.path.join(output_folder, "submit.csv")
         # AdobeはシンプルなUTF8や標準CSVを好む場合があります。
         submit_df.to_csv(submit_csv_path, index=False, encoding='utf-8')
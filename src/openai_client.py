@@ -0,0 +1,37 @@
+"""
+OpenAI Client Module.
+
+Provides a process-wide OpenAI client per API key.
+"""
+import threading
+import httpx
+from openai import DefaultHttpxClient, OpenAI
+
+# 429/5xx時の再試行回数。SDKがRetry-Afterを尊重しつつ指数バックオフ(ジッター付き)で再試行する
+MAX_RETRIES = 5
+
+# 共有クライアントの接続プール。生成ジョブ (MAX_WORKERS) や提出処理が並列に呼び出すため、
+# httpxのデフォルトより大きくしてkeep-aliveの接続を使い回す
+_HTTP_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=32)
+_HTTP_TIMEOUT = httpx.Timeout(600.0, connect=5.0)
+
+_clients = {}
+_client_lock = threading.Lock()
+
+def get_openai_client(api_key: str) -> OpenAI:
+    """
+    Returns the shared OpenAI client for the API key.
+    The client is thread-safe, so ImageGenerator (for every model) and
+    MetadataManager reuse one HTTP connection pool instead of opening
+    new TCP/TLS connections per instance.
+    """
+    with _client_lock:
+        client = _clients.get(api_key)
+        if client is None:
+            client = OpenAI(
+                api_key=api_key,
+                max_retries=MAX_RETRIES,
+                http_client=DefaultHttpxClient(limits=_HTTP_LIMITS, timeout=_HTTP_TIMEOUT)
+            )
+            _clients[api_key] = client
+        return client
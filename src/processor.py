@@ -5,16 +5,18 @@ Handles image manipulation tasks such as upscaling using OpenCV.
 """
 import cv2
 import numpy as np
-from src.storage import S3Manager
+from src.storage import get_s3_manager
 
 class ImageProcessor:
     """
     Handles image processing tasks, primarily upscaling using OpenCV.
     """
     def __init__(self):
-        self.s3 = S3Manager()
+        self.s3 = get_s3_manager()
 
-    def upscale_image(self, input_path: str, output_path: str, scale_factor: int = 2): # pylint: disable=too-many-locals
+    def upscale_image(
+        self, input_path: str, output_path: str, scale_factor: int = 2
+    ) -> bytes: # pylint: disable=too-many-locals
         """
         Upscale an image from S3 by the specified factor and save back to S3.
         S3上の画像をダウンロードし、アップスケール後にS3へアップロードします。
@@ -23,10 +25,14 @@ class ImageProcessor:
             input_path (str): S3 Key of the input image.
             output_path (str): S3 Key for the upscaled image.
             scale_factor (int): Factor to scale the image by. Default is 2.
+
+        Returns:
+            bytes: The encoded PNG that was uploaded (callers can reuse it
+            instead of downloading it again).
         """
         try:
-            # S3Manager is already imported
-            s3 = S3Manager()
+            # __init__で作成したS3Managerを使い回す
+            s3 = self.s3
 
             # S3からダウンロード
             print(f"Dowloading from S3: {input_path}")
@@ -53,13 +59,15 @@ class ImageProcessor:
             # エンコード (メモリバッファへ)
             is_success, buffer = cv2.imencode(".png", upscaled_img)
             
-            if is_success:
-                # S3へアップロード
-                s3.upload_file(buffer.tobytes(), output_path, content_type="image/png")
-                print(f"アップスケール画像をS3に保存しました: {output_path}")
-            else:
+            if not is_success:
                 raise ValueError("画像のエンコードに失敗しました")
 
+            # S3へアップロード
+            png_bytes = buffer.tobytes()
+            s3.upload_file(png_bytes, output_path, content_type="image/png")
+            print(f"アップスケール画像をS3に保存しました: {output_path}")
+            return png_bytes
+
         except Exception as e:
             print(f"画像 {input_path} のアップスケールエラー: {e}")
             raise e
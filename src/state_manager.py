@@ -3,166 +3,283 @@ State Manager Module.
 
 Manages the lifecycle and status of generated images (Unprocessed, Registered, Excluded).
 """
-import os
+import csv
+import json
+import heapq
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from botocore.exceptions import ClientError
 
-from typing import Dict, List
+from typing import Dict, List, Optional
 from datetime import datetime
-import pandas as pd
 
 STATUS_UNPROCESSED = "UNPROCESSED"
 STATUS_REGISTERED = "REGISTERED"
 STATUS_EXCLUDED = "EXCLUDED"
 
+# S3の一覧取得・prompt.csvの取得を並列に行うワーカー数
+PROMPT_FETCH_WORKERS = 16
+
 class StateManager:
     """
     画像のステータス（未処理、登録済、除外）を管理するクラス。
     データの永続化にはJSONファイルを使用する。
+    インスタンスは複数セッション・スレッドで共有されうるため、dbの更新はロックで保護する。
     """
-    def __init__(self, db_path: str = "data/image_status.json", base_dir: str = "output"):
+    def __init__(
+        self, db_path: str = "data/image_status.json", base_dir: str = "output", scan: bool = True
+    ):
+        """
+        scan: Falseの場合は起動時の全バッチスキャンを行わない
+            (ステータス更新や特定バッチの同期だけを行う呼び出し元向け)
+        """
         self.db_path = db_path
         self.base_dir = base_dir
         self.db = {} # Key: relative_path (or S3 Key), Value: {status, timestamp, meta}
+        self._lock = threading.RLock()
+        # dbが変更されるたびに増える値。表示側キャッシュのキーに使う
+        self.revision = 0
+        # save_dbの同時実行を1つにまとめるためのフラグ
+        self._saving = False
+        self._dirty = False
+        # ステータス -> パス集合 の索引 (load_dbで構築し、更新時に維持する)
+        self._by_status = defaultdict(set)
+        # dir_key -> {filename: (prompt, tags, keyword)} (読み込めたprompt.csvのみ)
+        self._prompt_maps: Dict[str, Dict[str, tuple]] = {}
         self.load_db()
-        self.scan_and_sync()
+        if scan:
+            self.scan_and_sync()
 
     def load_db(self):
         """データベース(JSON)をS3から読み込む"""
-        from src.storage import S3Manager
+        from src.storage import get_s3_manager
         try:
-            s3 = S3Manager()
-            if s3.file_exists(self.db_path):
-                self.db = s3.read_json(self.db_path)
-            else:
-                self.db = {}
+            # 存在確認 (HEAD) はせず、直接読んで未作成なら空で始める
+            self.db = get_s3_manager().read_json(self.db_path)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in ("404", "NoSuchKey"):
+                print(f"Warning: Failed to load DB from S3 ({e}). Initializing empty DB.")
+            self.db = {}
         except Exception as e: # pylint: disable=broad-exception-caught
             print(f"Warning: Failed to load DB from S3 ({e}). Initializing empty DB.")
             self.db = {}
+        self._rebuild_index()
+        self.revision += 1
+
+    def _rebuild_index(self):
+        """ステータス -> パス集合 の索引をdbから作り直す"""
+        with self._lock:
+            self._by_status = defaultdict(set)
+            for path, data in self.db.items():
+                self._by_status[data["status"]].add(path)
 
     def save_db(self):
-        """データベース(JSON)をS3に保存する"""
-        from src.storage import S3Manager
+        """
+        データベース(JSON)をS3に保存する。
+        シリアライズのみロック内で行い、アップロード中も他スレッドの読み書きを止めない。
+        保存中に別の保存要求が来た場合は、実行中の保存が終わった後に最新の状態を1回だけ保存する。
+        """
+        from src.storage import get_s3_manager
+        with self._lock:
+            self._dirty = True
+            if self._saving:
+                return
+            self._saving = True
+
         try:
-            s3 = S3Manager()
-            s3.write_json(self.db, self.db_path)
+            s3 = get_s3_manager()
+            while True:
+                with self._lock:
+                    if not self._dirty:
+                        # 確認と解除を同じロック内で行い、直後の保存要求を取りこぼさない
+                        self._saving = False
+                        return
+                    self._dirty = False
+                    payload = json.dumps(self.db, indent=2, ensure_ascii=False)
+                s3.upload_file(
+                    payload.encode('utf-8'), self.db_path, content_type="application/json"
+                )
         except Exception as e: # pylint: disable=broad-exception-caught
             print(f"Error saving DB to S3: {e}")
+            with self._lock:
+                # 保存できなかった変更は次回のsave_dbで再送する
+                self._dirty = True
+                self._saving = False
 
-    def scan_and_sync(self):
+    def scan_and_sync(self, batch_prefixes: Optional[List[str]] = None):
         """
         S3をスキャンし、DBに未登録の画像を 'UNPROCESSED' として追加する。
+        batch_prefixes: スキャン対象のバッチ (e.g. ["output/2024-01-01T00-00-00_cat/"])。
+            省略時はoutput/以下の全バッチ。生成ジョブの完了時は自分のバッチのみを渡す。
         """
-        from src.storage import S3Manager
+        from src.storage import get_s3_manager
         try:
-            s3 = S3Manager()
-            # output/以下の全オブジェクトを取得
-            objects = s3.list_objects(prefix="output/") # prefix="output/" is base
+            s3 = get_s3_manager()
+            # output/以下の全オブジェクトではなく、各バッチのgenerated_images/のみを並列に一覧する
+            # (thumbs/や提出物など対象外のオブジェクトを列挙しない)
+            if batch_prefixes is None:
+                batch_prefixes = s3.list_prefixes(prefix="output/") # prefix="output/" is base
+            # 対象: generated_imagesフォルダ内のpngファイル ((Key, LastModified)のみ保持する)
+            pngs = []
+            if batch_prefixes:
+                with ThreadPoolExecutor(
+                    max_workers=min(PROMPT_FETCH_WORKERS, len(batch_prefixes))
+                ) as ex:
+                    for batch_pngs in ex.map(
+                        lambda p: [
+                            obj for obj in s3.iter_objects(prefix=f"{p}generated_images/")
+                            if obj[0].endswith(".png")
+                        ],
+                        batch_prefixes
+                    ):
+                        pngs.extend(batch_pngs)
+
+            # 新規発見、またはメタデータが欠損している画像を集める
+            pending = []
+            for key, last_modified in pngs:
+                current_data = self.db.get(key)
+                if current_data is None or not current_data.get("prompt"):
+                    pending.append((key, last_modified))
+
+            if not pending:
+                return
+
+            # prompt.csvはディレクトリごとに1回だけ、並列に取得する
+            dir_keys = {self._dir_key(key) for key, _ in pending}
+            with ThreadPoolExecutor(max_workers=min(PROMPT_FETCH_WORKERS, len(dir_keys))) as ex:
+                prompt_maps = dict(zip(
+                    dir_keys, ex.map(lambda d: self._load_prompt_map(s3, d), dir_keys)
+                ))
 
-            found_keys = []
             updated = False
+            with self._lock:
+                for key, last_modified in pending:
+                    # pendingはロック外で集めたので、並行するスキャンやupdate_statusで
+                    # 登録・更新済みになっていないかロック内で確認し直す
+                    current_data = self.db.get(key)
+                    is_new = current_data is None
+                    if not is_new and current_data.get("prompt"):
+                        continue
+                    dir_key, _, filename = key.rpartition("/")
+                    prompt, tags, keyword = prompt_maps[dir_key].get(filename, ("", "", ""))
 
-            for obj in objects:
-                key = obj['Key']
-                # 対象: generated_imagesフォルダ内のpngファイル
-                if "generated_images/" in key and key.endswith(".png"):
-                    found_keys.append(key)
-                    
-                    # 新規発見、またはメタデータが欠損している場合は取得を試みる
-                    is_new = key not in self.db
-                    is_missing_meta = False
-                    if not is_new:
-                        current_data = self.db[key]
-                        if not current_data.get("prompt"):
-                            is_missing_meta = True
-                    
-                    if is_new or is_missing_meta:
-                        prompt, tags, keyword = self._extract_prompt_if_possible(key)
-                        
-                        # メタデータが取得できた場合、または新規の場合に更新
-                        if prompt or is_new:
-                            if is_new:
-                                self.db[key] = {
-                                    "status": STATUS_UNPROCESSED,
-                                    "added_at": obj['LastModified'].isoformat(),
-                                    "prompt": prompt,
-                                    "tags": tags,
-                                    "keyword": keyword
-                                }
-                            else:
-                                # 既存だがメタデータが埋まった場合
-                                self.db[key]["prompt"] = prompt
-                                self.db[key]["tags"] = tags
-                                self.db[key]["keyword"] = keyword
-                            
-                            updated = True
+                    # メタデータが取得できた場合、または新規の場合に更新
+                    if not (prompt or is_new):
+                        continue
+                    if is_new:
+                        self.db[key] = {
+                            "status": STATUS_UNPROCESSED,
+                            "added_at": last_modified.isoformat(),
+                            "prompt": prompt,
+                            "tags": tags,
+                            "keyword": keyword
+                        }
+                        self._by_status[STATUS_UNPROCESSED].add(key)
+                    else:
+                        # 既存だがメタデータが埋まった場合
+                        current_data["prompt"] = prompt
+                        current_data["tags"] = tags
+                        current_data["keyword"] = keyword
+                    updated = True
+                if updated:
+                    self.revision += 1
 
             if updated:
                 self.save_db()
         except Exception as e:
             print(f"S3 Scan Error: {e}")
 
-    def _extract_prompt_if_possible(self, file_key: str) -> tuple[str, str, str]:
+    @staticmethod
+    def _dir_key(file_key: str) -> str:
+        """
+        画像のS3 Keyから格納ディレクトリを返す
+        key: output/xxx/generated_images/img_001.png -> output/xxx/generated_images
+        """
+        # S3 Keyの区切りは常に"/"なので、OS依存のパス処理・区切り文字の置換はしない
+        return file_key.rpartition("/")[0]
+
+    def _load_prompt_map(self, s3, dir_key: str) -> Dict[str, tuple]:
         """
-        prompt.csvが同じディレクトリにあればそこからプロンプトを読み取る
-        Returns: (prompt, tags, keyword)
+        ディレクトリのprompt.csvを読み込み、ファイル名から引ける辞書にする
+        Returns: {filename: (prompt, tags, keyword)} prompt.csvが無い場合は空
+        prompt.csvはジョブの最後に1度だけ書かれるため、読み込めた結果はディレクトリ単位でキャッシュする
         """
+        cached = self._prompt_maps.get(dir_key)
+        if cached is not None:
+            return cached
         try:
-            # key: output/xxx/generated_images/img_001.png
-            # dir: output/xxx/generated_images
-            dir_key = os.path.dirname(file_key).replace("\\", "/") # ensure forward slash
-            csv_key = f"{dir_key}/prompt.csv"
-
-            from src.storage import S3Manager
-            s3 = S3Manager()
-            
-            if s3.file_exists(csv_key):
-                csv_bytes = s3.download_file(csv_key)
-                from io import BytesIO
-                df = pd.read_csv(BytesIO(csv_bytes))
-                
-                filename = os.path.basename(file_key)
-                row = df[df['filename'] == filename]
-                
-                if not row.empty:
-                    keyword = row.iloc[0].get('keyword', "")
-                    if pd.isna(keyword):
-                        keyword = ""
-                    return row.iloc[0]['prompt'], row.iloc[0].get('tags', ""), keyword
-        except Exception: # pylint: disable=broad-exception-caught
-            pass
-        return "", "", ""
-
-    def get_images_by_status(self, status: str) -> List[Dict]:
-        """指定したステータスの画像リストを返す"""
-        result = []
+            csv_bytes = s3.download_file(f"{dir_key}/prompt.csv")
+            prompt_map = {}
+            for row in csv.DictReader(StringIO(csv_bytes.decode('utf-8-sig'))):
+                prompt_map.setdefault(
+                    row.get('filename', ""),
+                    (row.get('prompt') or "", row.get('tags') or "", row.get('keyword') or "")
+                )
+        except Exception as e: # pylint: disable=broad-exception-caught
+            # まだ書かれていない (生成中) か壊れたファイル。スキャン全体は止めず、キャッシュもしない
+            print(f"Prompt CSV Error ({dir_key}): {e}")
+            return {}
+        self._prompt_maps[dir_key] = prompt_map
+        return prompt_map
+
+    def get_images_by_status(
+        self, status: str, offset: int = 0, limit: Optional[int] = None
+    ) -> List[Dict]:
+        """
+        指定したステータスの画像リストを返す (added_atの降順)。
+        offset/limitを指定した場合はその範囲のみ辞書をコピーして返す。
+        """
         # S3の存在確認はコストが高いので、DBにあるものは存在するとみなす方針に変更
         # もし厳密にやるなら s3.file_exists(path) だがリスト表示のたびにやるのは重い
-        for path, data in self.db.items():
-            if data["status"] == status:
-                item = data.copy()
-                item["path"] = path
-                result.append(item)
+        with self._lock:
+            # 先にキーだけでソートし、ページ分のみコピーする
+            # 索引から該当ステータスのパスのみを走査する
+            entries = [
+                (self.db[path].get("added_at", ""), path)
+                for path in self._by_status.get(status, ())
+            ]
+            # added_atの降順（新しい順）にソート (タプルをそのまま比較し、keyの関数呼び出しを省く)
+            # ページ指定時は必要な先頭部分だけを取り出す
+            if limit is None:
+                entries.sort(reverse=True)
+            else:
+                entries = heapq.nlargest(offset + limit, entries)
 
-        # added_atの降順（新しい順）にソート
-        result.sort(key=lambda x: x.get("added_at", ""), reverse=True)
-        return result
+            end = None if limit is None else offset + limit
+            return [{**self.db[path], "path": path} for _, path in entries[offset:end]]
+
+    def count_by_status(self, status: str) -> int:
+        """指定したステータスの画像数を返す"""
+        with self._lock:
+            return len(self._by_status.get(status, ()))
 
     def update_status(self, file_paths: List[str], new_status: str, extra_metadata: Dict = None):
         """
         指定された画像のステータスを更新する
         """
         updated = False
-        for path in file_paths:
-            # S3 Keyがそのまま渡ってくるはず
-            if path in self.db:
-                self.db[path]["status"] = new_status
-                self.db[path]["updated_at"] = datetime.now().isoformat()
-                
-                if extra_metadata:
-                    self.db[path].update(extra_metadata)
-                
-                updated = True
-            else:
-                print(f"Warning: Image not found in DB: {path}")
+        # 一括更新は同じ時刻として記録する (パスごとに時刻を整形しない)
+        now = datetime.now().isoformat()
+        with self._lock:
+            for path in file_paths:
+                # S3 Keyがそのまま渡ってくるはず
+                if path in self.db:
+                    self._by_status[self.db[path]["status"]].discard(path)
+                    self._by_status[new_status].add(path)
+                    self.db[path]["status"] = new_status
+                    self.db[path]["updated_at"] = now
+
+                    if extra_metadata:
+                        self.db[path].update(extra_metadata)
+
+                    updated = True
+                else:
+                    print(f"Warning: Image not found in DB: {path}")
+
+            if updated:
+                self.revision += 1
 
         if updated:
             self.save_db()
@@ -5,34 +5,104 @@ Handles S3 interactions using boto3.
 """
 import os
 import io
+from functools import lru_cache
+from concurrent.futures import Future, ThreadPoolExecutor
+import threading
+from datetime import datetime
+from typing import Iterator, Tuple
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from botocore.exceptions import ClientError
 from dotenv import load_dotenv
 
 # pylint: disable=broad-exception-caught
 
+# Shared pool for background uploads so PUTs overlap with other work
+_UPLOAD_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="s3-upload")
+
+# Shared client settings: a connection pool large enough for the parallel
+# prefetch/upload pools, TCP keep-alive and standard retries
+_CLIENT_CONFIG = Config(
+    max_pool_connections=64,
+    retries={'mode': 'standard', 'max_attempts': 3},
+    tcp_keepalive=True
+)
+
+# Objects above the threshold are fetched as concurrent byte-range GETs
+_DOWNLOAD_CONFIG = TransferConfig(
+    multipart_threshold=6 * 1024 * 1024,
+    multipart_chunksize=4 * 1024 * 1024,
+    max_concurrency=8
+)
+
+# Large uploads (e.g. upscaled PNGs) are split into concurrent part uploads
+_UPLOAD_CONFIG = TransferConfig(
+    multipart_threshold=6 * 1024 * 1024,
+    multipart_chunksize=5 * 1024 * 1024,
+    max_concurrency=8
+)
+
+@lru_cache(maxsize=None)
+def _load_env():
+    """
+    Loads .env once per process.
+    Re-reading the file on every S3Manager construction is avoided.
+    """
+    load_dotenv()
+
+_session = None
+_clients = {}
+_client_lock = threading.Lock()
+
+def _get_client(region: str, access_key_id: str, secret_access_key: str):
+    """
+    Returns the process-wide S3 client for the given region/credentials.
+    Clients are thread-safe and reused so every S3Manager shares one
+    connection pool instead of paying TCP/TLS handshakes per instance.
+    Session.client() itself is not thread-safe, so creation is serialized.
+    """
+    global _session # pylint: disable=global-statement
+    cache_key = (region, access_key_id, secret_access_key)
+    with _client_lock:
+        client = _clients.get(cache_key)
+        if client is None:
+            if _session is None:
+                _session = boto3.session.Session()
+            client = _session.client(
+                's3',
+                aws_access_key_id=access_key_id,
+                aws_secret_access_key=secret_access_key,
+                region_name=region,
+                config=_CLIENT_CONFIG
+            )
+            _clients[cache_key] = client
+        return client
+
 class S3Manager:
     """
     AWS S3 operations manager.
     Requires AWS credentials in environment variables or .env file.
     """
     def __init__(self):
-        load_dotenv()
+        _load_env()
         self.bucket = os.getenv("S3_BUCKET_NAME")
         self.region = os.getenv("AWS_REGION", "ap-northeast-1")
-        self.s3_client = boto3.client(
-            's3',
-            aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
-            aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-            region_name=self.region
-        )
+        self._access_key_id = os.getenv("AWS_ACCESS_KEY_ID")
+        self._secret_access_key = os.getenv("AWS_SECRET_ACCESS_KEY")
 
         if not self.bucket:
             raise ValueError("S3_BUCKET_NAME is not set in environment variables.")
 
+    @property
+    def s3_client(self):
+        """Shared boto3 S3 client (created on first use)."""
+        return _get_client(self.region, self._access_key_id, self._secret_access_key)
+
     def upload_file(self, file_obj, key: str, content_type: str = None) -> str:
         """
         Uploads a file-like object or bytes to S3 and returns the S3 Key.
+        Objects above the multipart threshold are uploaded in parallel parts.
         """
         extra_args = {}
         if content_type:
@@ -51,20 +121,31 @@ class S3Manager:
                 file_obj,
                 self.bucket,
                 key,
-                ExtraArgs=extra_args
+                ExtraArgs=extra_args,
+                Config=_UPLOAD_CONFIG
             )
             return key
         except ClientError as e:
             print(f"S3 Upload Error: {e}")
             raise e
 
+    def upload_file_async(self, file_obj, key: str, content_type: str = None) -> Future:
+        """
+        Schedules upload_file on the shared upload pool.
+        Returns a Future that resolves to the S3 Key (or raises the upload error).
+        """
+        return _UPLOAD_EXECUTOR.submit(self.upload_file, file_obj, key, content_type)
+
     def download_file(self, key: str) -> bytes:
         """
         Downloads a file from S3 as bytes.
+        Large objects are split into ranged GETs that run concurrently.
         """
         try:
             buffer = io.BytesIO()
-            self.s3_client.download_fileobj(self.bucket, key, buffer)
+            self.s3_client.download_fileobj(
+                self.bucket, key, buffer, Config=_DOWNLOAD_CONFIG
+            )
             buffer.seek(0)
             return buffer.read()
         except ClientError as e:
@@ -74,6 +155,20 @@ class S3Manager:
             print(f"S3 General Error: {e}")
             raise e
 
+    def iter_objects(self, prefix: str = "") -> Iterator[Tuple[str, datetime]]:
+        """
+        Yields (Key, LastModified) for objects under the prefix, page by page.
+        Callers can start processing before the listing finishes and no
+        per-object dict is built.
+        """
+        try:
+            paginator = self.s3_client.get_paginator('list_objects_v2')
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+                for obj in page.get('Contents', []):
+                    yield obj['Key'], obj['LastModified']
+        except ClientError as e:
+            print(f"S3 List Error: {e}")
+
     def list_objects(self, prefix: str = "") -> list:
         """
         Lists objects in the bucket with the given prefix.
@@ -97,6 +192,23 @@ class S3Manager:
             print(f"S3 List Error: {e}")
             return []
 
+    def list_prefixes(self, prefix: str = "", delimiter: str = "/") -> list:
+        """
+        Lists the immediate sub-prefixes ("directories") under the prefix.
+        Returns a list of prefix strings, e.g. ['output/2024-01-01T00-00-00_cat/'].
+        """
+        try:
+            paginator = self.s3_client.get_paginator('list_objects_v2')
+            pages = paginator.paginate(Bucket=self.bucket, Prefix=prefix, Delimiter=delimiter)
+            return [
+                common['Prefix']
+                for page in pages
+                for common in page.get('CommonPrefixes', [])
+            ]
+        except ClientError as e:
+            print(f"S3 List Error: {e}")
+            return []
+
     def get_presigned_url(self, key: str, expiration: int = 3600) -> str:
         """
         Generates a presigned URL for the S3 object.
@@ -155,3 +267,12 @@ class S3Manager:
         except Exception as e:
             print(f"S3 Write JSON Error: {e}")
             raise e
+
+
+@lru_cache(maxsize=1)
+def get_s3_manager() -> S3Manager:
+    """
+    Returns the process-wide S3Manager.
+    Use this instead of constructing S3Manager per operation.
+    """
+    return S3Manager()
@@ -5,26 +5,42 @@ Handles the submission process including upscaling,
 metadata generation, and packaging for Adobe Stock.
 """
 import os
+import io
+import csv
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from typing import List, Dict, Optional
-import pandas as pd
+from typing import Callable, List, Dict, Optional
 from tqdm import tqdm
 
 from src.processor import ImageProcessor
 from src.metadata import MetadataManager
 from src.state_manager import StateManager, STATUS_REGISTERED
 
+# アップスケールを並列に行うワーカー数 (1枚あたり数十MBのバッファを使うので控えめに)
+UPSCALE_WORKERS = min(4, os.cpu_count() or 1)
+
+# ZIPはこのサイズまではメモリ上に作り、超えたら一時ファイルに書き出す
+ZIP_SPOOL_SIZE = 64 * 1024 * 1024
+
 class SubmissionManager:
     """
     Class to upscale selected images, organize them into a submission folder,
     and generate the required CSV.
     """
-    def __init__(self, api_key: str):
+    def __init__(self, api_key: str, state_mgr: Optional[StateManager] = None):
         self.processor = ImageProcessor()
         self.metadata_mgr = MetadataManager(api_key)
-        self.state_mgr = StateManager()
+        # 共有インスタンスが渡された場合はDBの再読み込みを避けて再利用する
+        # 提出処理はステータス更新のみなので、自前で作る場合もS3の全スキャンはしない
+        self.state_mgr = state_mgr or StateManager(scan=False)
 
-    def process_submission(self, selected_images: List[Dict], keyword: str = "batch"): # pylint: disable=too-many-locals
+    def process_submission(
+        self,
+        selected_images: List[Dict],
+        keyword: str = "batch",
+        progress_callback: Optional[Callable[[int, int], None]] = None
+    ): # pylint: disable=too-many-locals
         """
         Execute the submission process for a list of selected images on S3.
         Creates a ZIP file containing upscaled images and submit.csv.
@@ -32,18 +48,18 @@ class SubmissionManager:
         Args:
             selected_images (List[Dict]): List of image dictionaries from StateManager.
             keyword (str): Identifier used for naming.
+            progress_callback (Callable): Called with (done, total) after each image.
 
         Returns:
-            bytes: ZIP file content.
+            str: S3 Key of the uploaded submission.zip (None if no image was processed).
         """
         if not selected_images:
             return None
 
-        from src.storage import S3Manager
+        from src.storage import get_s3_manager
         import zipfile
-        import io
         
-        s3 = S3Manager()
+        s3 = get_s3_manager()
         
         # 提出用一時ディレクトリパス (S3 Key prefix)
         timestamp = datetime.now().strftime('%Y-%m-%dT%H-%M-%S')
@@ -53,55 +69,71 @@ class SubmissionManager:
         csv_data = []
         processed_file_paths = []
         
-        # ZIPバッファ作成
-        zip_buffer = io.BytesIO()
+        # ZIPバッファ作成 (大きな提出でもメモリを使い切らないよう、一定サイズを超えたらディスクへ)
+        zip_buffer = tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_SIZE) # pylint: disable=consider-using-with
 
         print(f"提出処理を開始します: {len(selected_images)}枚")
 
-        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-            for idx, img_info in enumerate(tqdm(selected_images, desc="Upscaling & Packaging")):
-                try:
-                    result = self._process_single_image(idx, img_info, submission_prefix, s3)
-                    if result:
-                        csv_data.append(result['csv_entry'])
-                        processed_file_paths.append(result['rel_path'])
-                        
-                        # アップスケール画像をZIPに追加
-                        # S3からダウンロードしてZIPへ
-                        upscaled_key = result['upscaled_key']
-                        upscaled_filename = result['upscaled_filename']
-                        
-                        print(f"Adding to ZIP: {upscaled_key}")
-                        img_bytes = s3.download_file(upscaled_key)
-                        zip_file.writestr(upscaled_filename, img_bytes)
-
-                except Exception as e: # pylint: disable=broad-exception-caught
-                    print(f"Error processing {img_info.get('path')}: {e}")
+        # メタデータは画像ごとではなくまとめて生成する (リクエスト数を削減)
+        metas = self.metadata_mgr.get_images_metadata([
+            (img_info.get('prompt', ""), self._stored_tags(img_info))
+            for img_info in selected_images
+        ])
+
+        total = len(selected_images)
+        # PNGは圧縮済みなので再圧縮せずに格納する (CPU時間の節約)。CSVのみ個別に圧縮する
+        with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_STORED) as zip_file:
+            # アップスケール (S3 GET → OpenCV → S3 PUT) は画像ごとに独立しているので並列実行する
+            # OpenCVの処理中はGILが解放されるためスレッドで十分
+            # ZipFileはスレッドセーフではないため、書き込みはこのスレッドで行う
+            with ThreadPoolExecutor(max_workers=min(UPSCALE_WORKERS, total)) as executor:
+                futures = [
+                    executor.submit(
+                        self._process_single_image,
+                        idx, img_info, submission_prefix, s3, metas[idx]
+                    )
+                    for idx, img_info in enumerate(selected_images)
+                ]
+                position = {future: idx for idx, future in enumerate(futures)}
+                finished = set()
+                next_idx = 0
+                # 進捗は完了順に報告し、ZIPのエントリ順とsubmit.csvの行順は選択順に揃える
+                # (選択順で先頭から完了している分だけを書き出す)
+                for done, future in enumerate(
+                    tqdm(as_completed(futures), total=total, desc="Upscaling & Packaging"), 1
+                ):
+                    finished.add(position[future])
+                    while next_idx in finished:
+                        img_info = selected_images[next_idx]
+                        try:
+                            result = futures[next_idx].result()
+                            if result:
+                                print(f"Adding to ZIP: {result['upscaled_key']}")
+                                zip_file.writestr(
+                                    result['upscaled_filename'], result.pop('img_bytes')
+                                )
+                                csv_data.append(result['csv_entry'])
+                                processed_file_paths.append(result['rel_path'])
+                        except Exception as e: # pylint: disable=broad-exception-caught
+                            print(f"Error processing {img_info.get('path')}: {e}")
+                        next_idx += 1
+
+                    if progress_callback:
+                        progress_callback(done, total)
 
             # 4. CSV作成とZIPへの追加
             if csv_data:
-                # submit.csv作成
-                df = pd.DataFrame(csv_data)
-                # Adobe Stock用フォーマットへ
-                submit_df = df.rename(columns={
-                    'upscaled_filename': 'Filename',
-                    'title': 'Title',
-                    'tags': 'Keywords',
-                    'category': 'Category'
-                })
-                # 必要なカラムのみ
-                submit_df = submit_df[['Filename', 'Title', 'Keywords', 'Category']]
-                
-                csv_io = io.StringIO()
-                submit_df.to_csv(csv_io, index=False, encoding='utf-8-sig')
-                zip_file.writestr("submit.csv", csv_io.getvalue())
+                zip_file.writestr(
+                    "submit.csv", self._build_submit_csv(csv_data),
+                    compress_type=zipfile.ZIP_DEFLATED
+                )
 
+        zip_key = None
         if processed_file_paths:
-            # ZIPをS3にアップロード
-            zip_buffer.seek(0)
+            # ZIPをS3にアップロード (ダウンロードはPresigned URLで行い、ZIPをメモリに保持しない)
             zip_key = f"{submission_prefix}/submission.zip"
-            s3.upload_file(zip_buffer.getvalue(), zip_key, content_type="application/zip")
-            print(f"ZIPバックアップをS3に保存しました: {zip_key}")
+            s3.upload_file(zip_buffer, zip_key, content_type="application/zip")
+            print(f"ZIPをS3に保存しました: {zip_key}")
 
             # ステータス更新 (submission_idとしてprefixを記録)
             self.state_mgr.update_status(
@@ -111,18 +143,44 @@ class SubmissionManager:
             )
 
         print(f"提出バッチ処理完了")
-        zip_buffer.seek(0)
-        return zip_buffer.getvalue()
+        zip_buffer.close()
+        return zip_key
+
+    @staticmethod
+    def _build_submit_csv(rows: List[Dict]) -> str:
+        """
+        Adobe Stock用のsubmit.csvを作成する (DataFrameを介さず1行ずつ書き出す)。
+        形式: Filename, Title, Keywords, Category
+        """
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        writer.writerow(['Filename', 'Title', 'Keywords', 'Category'])
+        writer.writerows(
+            (row['upscaled_filename'], row['title'], row['tags'], row['category'])
+            for row in rows
+        )
+        return buffer.getvalue()
+
+    @staticmethod
+    def _stored_tags(img_info: Dict) -> List[str]:
+        """DBに保存されたカンマ区切りのタグをリストにする"""
+        stored_tags_str = img_info.get('tags', "")
+        if not stored_tags_str:
+            return []
+        # 各タグのstripは1回だけ行う
+        return [t for t in map(str.strip, stored_tags_str.split(",")) if t]
 
     def _process_single_image(
         self,
         idx: int,
         img_info: Dict,
         submission_prefix: str,
-        _s3_client
+        _s3_client,
+        meta: Dict
     ) -> Optional[Dict]:
         """
-        Process a single image: upscale, generate metadata, and prepare CSV entry.
+        Process a single image: upscale and prepare CSV entry.
+        meta: metadata generated in advance by MetadataManager.get_images_metadata.
         """
         input_key = img_info['path'] # S3 Key
 
@@ -134,22 +192,14 @@ class SubmissionManager:
         output_key = f"{submission_prefix}/{new_filename}"
 
         # 2. アップスケール実行 (S3 -> S3)
-        self.processor.upscale_image(input_key, output_key)
+        # エンコード済みPNGはそのままZIPに使う (S3からの再ダウンロードはしない)
+        img_bytes = self.processor.upscale_image(input_key, output_key)
 
         # 3. メタデータ取得
         prompt = img_info.get('prompt', "")
         # プロンプトバックアップロジックはS3化が難しいので簡易的にスキップ
         # 必要ならget_objectでメタデータを取るべきだが今回は省略
 
-        # タグ生成
-        stored_tags_str = img_info.get('tags', "")
-        stored_tags = (
-            [t.strip() for t in stored_tags_str.split(",") if t.strip()]
-            if stored_tags_str else []
-        )
-
-        meta = self.metadata_mgr.get_image_metadata(prompt, user_tags=stored_tags)
-
         return {
             "csv_entry": {
                 "filename": os.path.basename(input_key),
@@ -161,5 +211,6 @@ class SubmissionManager:
             },
             "rel_path": input_key,
             "upscaled_key": output_key,
-            "upscaled_filename": new_filename
+            "upscaled_filename": new_filename,
+            "img_bytes": img_bytes
         }
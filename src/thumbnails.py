@@ -0,0 +1,27 @@
+"""
+Thumbnail Module.
+
+Creates the small WEBP previews shown in the gallery grid and maps
+image keys to their thumbnail keys on S3.
+"""
+from io import BytesIO
+from PIL import Image
+
+# 4列グリッドの表示幅 (高DPI込み) に足りる最大辺
+THUMBNAIL_SIZE = (512, 512)
+
+def thumbnail_key(image_key: str) -> str:
+    """
+    画像のS3 Keyからサムネイルの保存先を返す。
+    e.g. output/xxx/generated_images/img_001.png -> output/xxx/thumbs/img_001.webp
+    """
+    thumb_key = image_key.replace("/generated_images/", "/thumbs/")
+    return thumb_key.rsplit(".", 1)[0] + ".webp"
+
+def make_thumbnail(img_bytes: bytes) -> bytes:
+    """Resize image bytes to fit THUMBNAIL_SIZE and encode them as WEBP."""
+    with Image.open(BytesIO(img_bytes)) as img:
+        img.thumbnail(THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
+        out = BytesIO()
+        img.save(out, "WEBP", quality=82)
+    return out.getvalue()